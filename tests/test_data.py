@@ -0,0 +1,313 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import copy
+import pickle
+import random
+import unittest
+
+from wbs.data import ImmutableDict
+from wbs.data import ImmutableTuple
+from wbs.data import apply_patch
+from wbs.data import deep_copy
+from wbs.data import deep_freeze
+from wbs.data import diff
+from wbs.data import fingerprint
+from wbs.data import freeze
+from wbs.data import same_content
+
+def ordered (* items):
+
+	return collections.OrderedDict (items)
+
+def sample_tree ():
+
+	return ordered (
+		("name", "x"),
+		("hosts", [
+			ordered (("host", "a"), ("port", 80)),
+			ordered (("host", "b"), ("tags", [ "web", "db" ])),
+		]),
+		("settings", ordered (
+			("nested", ordered (("deep", [ 1, [ 2, 3 ] ]),)),
+		)),
+	)
+
+# random trees for round trips, with small key and value sets so that
+# changes line up with existing keys often
+
+def random_tree (generator, depth = 3):
+
+	choice = generator.random ()
+
+	if depth == 0 or choice < 0.3:
+		return generator.choice ([ 1, 2, True, 1.0, "a", "b", None ])
+
+	if choice < 0.65:
+
+		keys = [ "k%d" % index for index in xrange (6) ]
+
+		generator.shuffle (keys)
+
+		return ordered (* [
+			(key, random_tree (generator, depth - 1))
+			for key in keys [: generator.randrange (5)]
+		])
+
+	return [
+		random_tree (generator, depth - 1)
+		for index in xrange (generator.randrange (4))
+	]
+
+def describe (value):
+
+	# types and key order matter as well as equality
+
+	if isinstance (value, dict):
+
+		return (
+			type (value).__name__,
+			[
+				(key, describe (item))
+				for key, item in value.items ()
+			],
+		)
+
+	if isinstance (value, (list, tuple)):
+		return ("list", [ describe (item) for item in value ])
+
+	return (type (value).__name__, value)
+
+class CopyOnWriteTest (unittest.TestCase):
+
+	def test_writes_leave_the_source_alone (self):
+
+		source = sample_tree ()
+		original = copy.deepcopy (source)
+
+		lazy = deep_copy (source, lazy = True)
+
+		lazy ["hosts"] [1] ["tags"].append ("cache")
+		lazy ["settings"] ["nested"] ["deep"] [1] [0] = 20
+		lazy ["name"] = "y"
+		del lazy ["hosts"] [0] ["port"]
+
+		self.assertEqual (source, original)
+
+		expected = copy.deepcopy (original)
+		expected ["hosts"] [1] ["tags"].append ("cache")
+		expected ["settings"] ["nested"] ["deep"] [1] [0] = 20
+		expected ["name"] = "y"
+		del expected ["hosts"] [0] ["port"]
+
+		self.assertEqual (lazy.materialize (), expected)
+
+	def test_reads_share_the_source (self):
+
+		source = sample_tree ()
+
+		lazy = deep_copy (source, lazy = True)
+
+		lazy ["hosts"] [0] ["port"] = 81
+
+		self.assertEqual (lazy ["hosts"] [1] ["tags"], source ["hosts"] [1] ["tags"])
+		self.assertEqual (lazy ["settings"], source ["settings"])
+
+	def test_copy_of_a_copy (self):
+
+		source = sample_tree ()
+
+		first = deep_copy (source, lazy = True)
+		first ["hosts"] [0] ["port"] = 81
+
+		second = deep_copy (first, lazy = True)
+		second ["hosts"] [0] ["port"] = 82
+		second ["settings"] ["nested"] ["deep"].append (4)
+
+		self.assertEqual (first ["hosts"] [0] ["port"], 81)
+		self.assertEqual (first ["settings"] ["nested"] ["deep"], [ 1, [ 2, 3 ] ])
+		self.assertEqual (second ["hosts"] [0] ["port"], 82)
+		self.assertEqual (source ["hosts"] [0] ["port"], 80)
+
+	def test_deep_copy (self):
+
+		source = sample_tree ()
+
+		self.assertEqual (describe (deep_copy (source)), describe (source))
+		self.assertIsNot (deep_copy (source) ["hosts"], source ["hosts"])
+
+		frozen = deep_freeze (source)
+
+		self.assertIs (deep_copy (frozen, share = True), frozen)
+		self.assertEqual (deep_copy (frozen), source)
+
+class DiffTest (unittest.TestCase):
+
+	def assert_patches (self, old, new):
+
+		patched = apply_patch (deep_copy (old), diff (old, new))
+
+		self.assertEqual (describe (patched), describe (new))
+
+	def test_changes (self):
+
+		old = sample_tree ()
+
+		new = deep_copy (old)
+		new ["name"] = "y"
+		new ["hosts"].pop ()
+		new ["hosts"] [0] ["port"] = True
+		new ["settings"] ["nested"] ["deep"] [1].append (4)
+		new ["added"] = [ ordered (("z", 1),) ]
+
+		self.assert_patches (old, new)
+		self.assert_patches (new, old)
+
+		self.assertEqual (diff (old, deep_copy (old)), [])
+
+	def test_typed_scalars (self):
+
+		self.assertEqual (diff (1, True), [ ("replace", (), True) ])
+		self.assertEqual (diff ([ 1.0 ], [ 1 ]), [ ("replace", (0,), 1) ])
+
+	def test_key_order (self):
+
+		old = ordered (("a", 1), ("b", ordered (("c", 2), ("d", 3))))
+		new = ordered (("b", ordered (("d", 3), ("c", 2))), ("a", 1))
+
+		operations = diff (old, new)
+
+		self.assertIn (("reorder", (), [ "b", "a" ]), operations)
+		self.assertIn (("reorder", ("b",), [ "d", "c" ]), operations)
+
+		self.assert_patches (old, new)
+
+		# plain dictionaries have no order to keep
+
+		self.assertEqual (diff ({ "a": 1, "b": 2 }, { "b": 2, "a": 1 }), [])
+
+	def test_frozen_trees (self):
+
+		old = deep_freeze (sample_tree ())
+
+		swapped = sample_tree ()
+		swapped ["hosts"] [0] = ordered (("port", 80), ("host", "a"))
+
+		new = deep_freeze (swapped)
+
+		self.assertTrue (same_content (old, new))
+
+		self.assertEqual (
+			diff (old, new),
+			[ ("reorder", ("hosts", 0), [ "port", "host" ]) ])
+
+		self.assertEqual (diff (old, deep_freeze (sample_tree ())), [])
+
+		self.assert_patches (
+			deep_copy (old),
+			deep_copy (new))
+
+	def test_random_round_trips (self):
+
+		generator = random.Random (3)
+
+		for attempt in xrange (300):
+
+			old = random_tree (generator)
+			new = random_tree (generator)
+
+			self.assert_patches (old, new)
+
+			self.assertEqual (
+				diff (deep_freeze (old), deep_freeze (old)),
+				[])
+
+class DigestTest (unittest.TestCase):
+
+	def test_content_not_equality (self):
+
+		self.assertEqual (
+			fingerprint (ordered (("a", 1), ("b", 2))),
+			fingerprint (ordered (("b", 2), ("a", 1))))
+
+		self.assertEqual (fingerprint ([ 1, "x" ]), fingerprint ((1, "x")))
+		self.assertEqual (fingerprint ("x"), fingerprint (b"x"))
+
+		digests = set ([
+			fingerprint (value)
+			for value in [ 1, True, 1.0, "1", None, [ 1 ], { "1": 1 } ]
+		])
+
+		self.assertEqual (len (digests), 7)
+
+	def test_frozen_digests (self):
+
+		tree = sample_tree ()
+		frozen = deep_freeze (tree)
+
+		self.assertEqual (fingerprint (frozen), fingerprint (tree))
+		self.assertTrue (same_content (frozen, deep_freeze (sample_tree ())))
+		self.assertFalse (same_content (frozen, deep_freeze ([ tree ])))
+
+		# the digest is cached on the frozen value
+
+		self.assertIsNotNone (frozen ["hosts"]._digest)
+
+class FrozenTest (unittest.TestCase):
+
+	def test_deep_freeze (self):
+
+		frozen = deep_freeze (sample_tree ())
+
+		self.assertIsInstance (frozen, ImmutableDict)
+		self.assertIsInstance (frozen ["hosts"], ImmutableTuple)
+		self.assertEqual (list (frozen), [ "name", "hosts", "settings" ])
+		self.assertEqual (describe (deep_copy (frozen)), describe (sample_tree ()))
+
+		for modify in [
+			lambda: frozen.__setitem__ ("a", 1),
+			lambda: frozen.__delitem__ ("name"),
+			lambda: frozen.update (a = 1),
+			lambda: frozen.pop ("name"),
+			lambda: frozen.__init__ ([ ("a", 1) ]),
+		]:
+
+			with self.assertRaises (Exception):
+				modify ()
+
+		self.assertEqual (list (frozen), [ "name", "hosts", "settings" ])
+
+	def test_pickle (self):
+
+		frozen = deep_freeze (sample_tree ())
+
+		loaded = pickle.loads (pickle.dumps (frozen, 2))
+
+		self.assertEqual (describe (loaded), describe (frozen))
+		self.assertIsInstance (loaded ["hosts"], ImmutableTuple)
+
+	def test_child_proxies (self):
+
+		source = sample_tree ()
+		frozen = freeze (source)
+
+		self.assertIs (frozen ["hosts"] [0], frozen ["hosts"] [0])
+		self.assertIs (list (frozen ["hosts"]) [1], frozen ["hosts"] [1])
+
+		held = frozen ["settings"]
+
+		source ["settings"] = ordered (("other", 1),)
+
+		self.assertIsNot (frozen ["settings"], held)
+		self.assertEqual (list (frozen ["settings"]), [ "other" ])
+
+		with self.assertRaises (Exception):
+			frozen ["hosts"] [0] ["port"] = 81
+
+if __name__ == "__main__":
+	unittest.main ()
+
+# ex: noet ts=4 filetype=python
@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+import unittest
+
+from wbs.lazy import ThreadSafeLazyDictionary
+
+class ThreadSafeLazyDictionaryTest (unittest.TestCase):
+
+	def setUp (self):
+
+		self.source = { "key": 1 }
+		self.calls = []
+
+		self.started = threading.Event ()
+		self.resume = threading.Event ()
+
+		self.dictionary = ThreadSafeLazyDictionary (self.slow_lookup)
+
+	def slow_lookup (self, key):
+
+		value = self.source [key]
+
+		self.calls.append (key)
+
+		if len (self.calls) == 1:
+
+			self.started.set ()
+			self.resume.wait ()
+
+		return value
+
+	def start_lookup (self):
+
+		results = []
+
+		thread = threading.Thread (
+			target = lambda: results.append (self.dictionary ["key"]))
+
+		thread.start ()
+
+		self.started.wait ()
+
+		return thread, results
+
+	def test_single_flight (self):
+
+		thread, results = self.start_lookup ()
+
+		waiter_results = []
+
+		waiter = threading.Thread (
+			target = lambda: waiter_results.append (self.dictionary ["key"]))
+
+		waiter.start ()
+
+		self.resume.set ()
+
+		thread.join ()
+		waiter.join ()
+
+		self.assertEqual (results, [ 1 ])
+		self.assertEqual (waiter_results, [ 1 ])
+		self.assertEqual (self.calls, [ "key" ])
+
+	def test_invalidate_during_flight (self):
+
+		thread, results = self.start_lookup ()
+
+		self.source ["key"] = 2
+		self.dictionary.invalidate ("key")
+
+		self.resume.set ()
+
+		thread.join ()
+
+		self.assertEqual (results, [ 1 ])
+		self.assertNotIn ("key", self.dictionary)
+
+		self.assertEqual (self.dictionary ["key"], 2)
+		self.assertEqual (self.calls, [ "key", "key" ])
+
+	def test_clear_during_flight (self):
+
+		thread, results = self.start_lookup ()
+
+		self.source ["key"] = 2
+		self.dictionary.clear ()
+
+		self.resume.set ()
+
+		thread.join ()
+
+		self.assertNotIn ("key", self.dictionary)
+		self.assertEqual (self.dictionary ["key"], 2)
+
+if __name__ == "__main__":
+	unittest.main ()
+
+# ex: noet ts=4 filetype=python
@@ -0,0 +1,299 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import random
+import unittest
+
+from wbs.data import content_digest
+from wbs.data import diff
+from wbs.persistent import PersistentOrderedMap
+from wbs.persistent import PersistentVector
+from wbs.persistent import from_persistent
+from wbs.persistent import to_persistent
+
+# keys whose hashes are all equal, so they end up in one collision node
+
+class CollidingKey (object):
+
+	def __init__ (self, name):
+
+		self.name = name
+
+	def __hash__ (self):
+
+		return 42
+
+	def __eq__ (self, other):
+
+		return isinstance (other, CollidingKey) \
+			and self.name == other.name
+
+	def __ne__ (self, other):
+
+		return not self == other
+
+	def __repr__ (self):
+
+		return "CollidingKey (%r)" % self.name
+
+class PersistentVectorTest (unittest.TestCase):
+
+	sizes = [ 0, 1, 31, 32, 33, 1024, 1025, 1056, 1057 ]
+
+	def test_from_items (self):
+
+		for size in self.sizes:
+
+			items = range (size)
+			vector = PersistentVector.from_items (items)
+
+			self.assertEqual (len (vector), size)
+			self.assertEqual (list (vector), items)
+
+			for index in [ 0, size // 2, size - 1 ]:
+
+				if size:
+					self.assertEqual (vector [index], index)
+
+	def test_append (self):
+
+		vector = PersistentVector ()
+
+		for index in xrange (1100):
+
+			vector = vector.append (index)
+
+			self.assertEqual (vector [-1], index)
+
+		self.assertEqual (list (vector), range (1100))
+
+	def test_old_versions (self):
+
+		versions = [ PersistentVector () ]
+
+		for index in xrange (1100):
+			versions.append (versions [-1].append (index))
+
+		changed = versions [-1].set (500, "x")
+
+		for count, vector in enumerate (versions):
+			self.assertEqual (list (vector), range (count))
+
+		self.assertEqual (changed [500], "x")
+		self.assertEqual (changed [499], 499)
+		self.assertEqual (versions [-1] [500], 500)
+
+	def test_indexes (self):
+
+		vector = PersistentVector.from_items ("abcde")
+
+		self.assertEqual (vector [-1], "e")
+		self.assertEqual (vector [1 : 3], [ "b", "c" ])
+		self.assertEqual (vector [: : -2], [ "e", "c", "a" ])
+
+		with self.assertRaises (IndexError):
+			vector [5]
+
+		with self.assertRaises (IndexError):
+			vector.set (-6, "x")
+
+class PersistentOrderedMapTest (unittest.TestCase):
+
+	def test_insertion_order (self):
+
+		keys = [ "k%d" % index for index in xrange (100) ]
+
+		random.Random (1).shuffle (keys)
+
+		persistent_map = PersistentOrderedMap.from_items ([
+			(key, index)
+			for index, key in enumerate (keys)
+		])
+
+		self.assertEqual (list (persistent_map), keys)
+		self.assertEqual (persistent_map [keys [10]], 10)
+
+		persistent_map = persistent_map.set (keys [10], "x")
+
+		self.assertEqual (list (persistent_map), keys)
+		self.assertEqual (persistent_map [keys [10]], "x")
+
+		persistent_map = persistent_map.delete (keys [0]).set (keys [0], 0)
+
+		self.assertEqual (list (persistent_map), keys [1 :] + keys [: 1])
+
+	def test_old_versions (self):
+
+		versions = [ PersistentOrderedMap () ]
+
+		for index in xrange (200):
+			versions.append (versions [-1].set (index, index))
+
+		for index in xrange (0, 200, 2):
+			versions.append (versions [-1].delete (index))
+
+		for count in xrange (201):
+
+			self.assertEqual (
+				list (versions [count].items ()),
+				[ (index, index) for index in xrange (count) ])
+
+		self.assertEqual (
+			list (versions [-1]),
+			range (1, 200, 2))
+
+	def test_hash_collisions (self):
+
+		keys = [ CollidingKey (index) for index in xrange (10) ]
+
+		persistent_map = PersistentOrderedMap ()
+
+		for index, key in enumerate (keys):
+			persistent_map = persistent_map.set (key, index)
+
+		persistent_map = persistent_map.set ("other", "o")
+
+		for index, key in enumerate (keys):
+			self.assertEqual (persistent_map [key], index)
+
+		self.assertNotIn (CollidingKey (10), persistent_map)
+
+		for key in keys [: -1]:
+
+			persistent_map = persistent_map.delete (key)
+
+			self.assertNotIn (key, persistent_map)
+
+		self.assertEqual (persistent_map [keys [-1]], 9)
+		self.assertEqual (list (persistent_map), [ keys [-1], "other" ])
+
+		with self.assertRaises (KeyError):
+			persistent_map.delete (keys [0])
+
+	def test_partial_hash_collisions (self):
+
+		# these share their low bits, so they only part at deeper levels
+
+		keys = [ 7 + (index << 25) for index in xrange (40) ]
+
+		persistent_map = PersistentOrderedMap.from_items ([
+			(key, key)
+			for key in keys
+		])
+
+		for key in keys:
+			self.assertEqual (persistent_map [key], key)
+
+		for key in keys [: : 3]:
+			persistent_map = persistent_map.delete (key)
+
+		self.assertEqual (
+			list (persistent_map),
+			[ key for index, key in enumerate (keys) if index % 3 ])
+
+	def test_against_dictionary (self):
+
+		generator = random.Random (2)
+
+		model = collections.OrderedDict ()
+		persistent_map = PersistentOrderedMap ()
+
+		for step in xrange (3000):
+
+			key = generator.choice ([
+				generator.randrange (300),
+				CollidingKey (generator.randrange (5)),
+			])
+
+			if key in model and generator.random () < 0.4:
+
+				del model [key]
+
+				persistent_map = persistent_map.delete (key)
+
+			else:
+
+				model [key] = step
+
+				persistent_map = persistent_map.set (key, step)
+
+			self.assertEqual (len (persistent_map), len (model))
+
+		self.assertEqual (list (persistent_map.items ()), list (model.items ()))
+
+	def test_evolve_shares_branches (self):
+
+		tree = to_persistent (collections.OrderedDict ([
+			("a", collections.OrderedDict ([
+				("b", [ 1, 2, collections.OrderedDict ([ ("c", 3) ]) ]),
+			])),
+			("d", collections.OrderedDict ([ ("e", 4) ])),
+		]))
+
+		changed = tree.evolve (("a", "b", 2, "c"), 30)
+
+		self.assertEqual (tree ["a"] ["b"] [2] ["c"], 3)
+		self.assertEqual (changed ["a"] ["b"] [2] ["c"], 30)
+
+		self.assertIs (changed ["d"], tree ["d"])
+		self.assertEqual (changed ["a"] ["b"] [0], 1)
+
+		with self.assertRaises (Exception):
+			tree.evolve (("d", "e", "f"), 5)
+
+	def test_round_trip (self):
+
+		plain = collections.OrderedDict ([
+			("name", "x"),
+			("items", [ 1, collections.OrderedDict ([ ("z", None) ]), [] ]),
+			("empty", collections.OrderedDict ()),
+		])
+
+		self.assertEqual (from_persistent (to_persistent (plain)), plain)
+
+	def test_digests_follow_updates (self):
+
+		plain = collections.OrderedDict ([
+			("a", [ 1, 2, 3 ]),
+			("b", collections.OrderedDict ([ ("c", "d") ])),
+		])
+
+		tree = to_persistent (plain)
+		content_digest (tree)
+
+		changed = (
+			tree
+				.evolve (("a", 1), 20)
+				.evolve (("b", "e"), "f")
+				.set ("g", True)
+				.delete ("a"))
+
+		expected = collections.OrderedDict ([
+			("b", collections.OrderedDict ([ ("c", "d"), ("e", "f") ])),
+			("g", True),
+		])
+
+		self.assertEqual (content_digest (changed), content_digest (expected))
+		self.assertEqual (content_digest (tree), content_digest (plain))
+
+	def test_diff_order (self):
+
+		tree = to_persistent (collections.OrderedDict ([
+			("a", collections.OrderedDict ([ ("x", 1), ("y", 2) ])),
+		]))
+
+		swapped = to_persistent (collections.OrderedDict ([
+			("a", collections.OrderedDict ([ ("y", 2), ("x", 1) ])),
+		]))
+
+		self.assertEqual (content_digest (tree), content_digest (swapped))
+		self.assertEqual (diff (tree, to_persistent (from_persistent (tree))), [])
+		self.assertEqual (diff (tree, swapped), [ ("reorder", ("a",), [ "y", "x" ]) ])
+
+if __name__ == "__main__":
+	unittest.main ()
+
+# ex: noet ts=4 filetype=python
@@ -0,0 +1,312 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import pickle
+import unittest
+
+import wbs.yamlx as yamlx
+
+from wbs.schema import SchemaDatabase
+from wbs.schema import SchemaViolation
+
+def service_database ():
+
+	database = SchemaDatabase ()
+
+	database.read ("service", collections.OrderedDict ([
+		("general", collections.OrderedDict ([
+			("name", { "type": "str", "required": True, "default": "d" }),
+			("port", { "type": "int", "default": 80 }),
+			("note", { "type": "str" }),
+			("tags", { "type": "list", "default": [] }),
+			("parent", { "type": "dict", "sub_schema": "service" }),
+		])),
+	]))
+
+	return database
+
+class SchemaRecordTest (unittest.TestCase):
+
+	def setUp (self):
+
+		self.record_class = (
+			service_database ().record_class ("service"))
+
+	def assert_round_trip (self, data):
+
+		record = self.record_class (data)
+
+		self.assertEqual (record.to_dict (), data)
+		self.assertEqual (self.record_class (record.to_dict ()), record)
+
+	def test_round_trip (self):
+
+		self.assert_round_trip (collections.OrderedDict ([
+			("name", "web"),
+			("port", 8080),
+			("note", "hello"),
+		]))
+
+	def test_round_trip_values_equal_to_defaults (self):
+
+		self.assert_round_trip (collections.OrderedDict ([
+			("name", "d"),
+			("port", 80),
+			("tags", []),
+		]))
+
+	def test_round_trip_explicit_none (self):
+
+		self.assert_round_trip (collections.OrderedDict ([
+			("name", "web"),
+			("note", None),
+		]))
+
+	def test_round_trip_sub_records_and_extra_keys (self):
+
+		self.assert_round_trip (collections.OrderedDict ([
+			("name", "child"),
+			("parent", collections.OrderedDict ([
+				("name", "d"),
+				("port", 80),
+			])),
+			("unknown", [ 1, 2 ]),
+		]))
+
+	def test_missing_fields_are_left_out (self):
+
+		record = self.record_class ({ "name": "web" })
+
+		self.assertEqual (record.port, 80)
+		self.assertEqual (record.tags, [])
+		self.assertEqual (record.to_dict (), { "name": "web" })
+
+		record.port = 81
+
+		self.assertEqual (
+			record.to_dict (),
+			{ "name": "web", "port": 81 })
+
+	def test_missing_required_field (self):
+
+		with self.assertRaises (Exception):
+			self.record_class ({ "port": 80 })
+
+layer_document = (
+	"---\n\n"
+	"item: \n  \n"
+	"  id: \"1\"\n"
+	"  name: \"n\"\n\n\n\n"
+	"# ex: et ts=2 filetype=yaml")
+
+base_document = (
+	"---\n\n"
+	"item: \n  \n"
+	"  name: \"n\"\n  \n"
+	"  id: \"1\"\n\n\n\n"
+	"# ex: et ts=2 filetype=yaml")
+
+def layered_databases ():
+
+	base = SchemaDatabase ()
+
+	base.read ("item", {
+		"general": {
+			"name": { "type": "str" },
+		},
+	})
+
+	base.read ("outer", {
+		"general": {
+			"item": { "type": "dict", "sub_schema": "item" },
+		},
+	})
+
+	top = SchemaDatabase (parent = base)
+
+	top.read ("item", collections.OrderedDict ([
+		("general", collections.OrderedDict ([
+			("id", { "type": "int", "required": True }),
+			("name", { "type": "str" }),
+		])),
+	]))
+
+	return base, top
+
+class SchemaValidatorTest (unittest.TestCase):
+
+	def setUp (self):
+
+		self.database = SchemaDatabase ()
+
+		self.database.read ("person", {
+			"general": {
+				"name": { "type": "str", "required": True },
+				"age": { "type": "int" },
+				"role": { "type": "str", "values": [ "admin", "user" ] },
+				"friends": { "type": "list", "sub_schema": "person" },
+				"address": {
+					"type": "dict",
+					"sub_schema": {
+						"general": {
+							"city": { "type": "str", "required": True },
+						},
+					},
+				},
+			},
+		})
+
+		self.validator = self.database.compile ("person")
+
+	def test_valid (self):
+
+		self.assertEqual (
+			self.validator.validate ({
+				"name": "a",
+				"age": 3,
+				"role": "user",
+				"friends": [ { "name": "b", "friends": [] } ],
+				"address": { "city": "c" },
+				"unknown": object (),
+			}),
+			[])
+
+	def test_violations (self):
+
+		self.assertEqual (
+			self.validator.validate (collections.OrderedDict ([
+				("age", True),
+				("role", "owner"),
+				("friends", [
+					{ "name": 1 },
+					collections.OrderedDict ([ ("name", "c"), ("role", []) ]),
+				]),
+				("address", {}),
+			])),
+			[
+				SchemaViolation (("name",), "Missing required field"),
+				SchemaViolation (("age",), "Expected int but got bool"),
+				SchemaViolation (("role",), "Invalid value u'owner'"),
+				SchemaViolation (("friends", 0, "name"), "Expected str but got int"),
+				SchemaViolation (("friends", 1, "role"), "Expected str but got list"),
+				SchemaViolation (("address", "city"), "Missing required field"),
+			])
+
+	def test_not_a_mapping (self):
+
+		self.assertEqual (
+			self.validator.validate ([], ("root",)),
+			[ SchemaViolation (("root",), "Expected a mapping but got list") ])
+
+	def test_validate_tree (self):
+
+		self.assertEqual (
+			self.validator.validate_tree ({
+				"one": { "name": "a" },
+				"two": { "age": 1 },
+			}),
+			[ SchemaViolation (("two", "name"), "Missing required field") ])
+
+	def test_redefined_schema (self):
+
+		self.database.read ("person", {
+			"general": {
+				"id": { "type": "int", "required": True },
+			},
+		})
+
+		self.assertEqual (
+			self.database.compile ("person").validate ({ "name": "a" }),
+			[ SchemaViolation (("id",), "Missing required field") ])
+
+class SchemaDatabaseTest (unittest.TestCase):
+
+	def test_layers_resolve_references_alike (self):
+
+		base, top = layered_databases ()
+
+		data = collections.OrderedDict ([
+			("item", collections.OrderedDict ([ ("name", "n"), ("id", 1) ])),
+		])
+
+		self.assertEqual (
+			top.compile ("outer").validate ({ "item": { "name": "n" } }),
+			[ SchemaViolation (("item", "id"), "Missing required field") ])
+
+		self.assertEqual (
+			base.compile ("outer").validate ({ "item": { "name": "n" } }),
+			[])
+
+		item_class = top.record_class ("outer").record_fields [0] [4]
+
+		self.assertEqual (
+			[ record_field [0] for record_field in item_class.record_fields ],
+			[ "id", "name" ])
+
+		# the layer's item lists id as a field, so it is written in the
+		# schema's order, the base's doesn't, so it follows the other keys
+
+		self.assertEqual (
+			yamlx.encode (top ["outer"], data),
+			layer_document)
+
+		self.assertEqual (
+			yamlx.encode (base ["outer"], data),
+			base_document)
+
+	def test_encoder_follows_redefinitions (self):
+
+		base, top = layered_databases ()
+
+		data = collections.OrderedDict ([
+			("item", collections.OrderedDict ([ ("name", "n"), ("id", 1) ])),
+		])
+
+		self.assertEqual (
+			yamlx.encode (base ["outer"], data),
+			base_document)
+
+		base.read ("item", collections.OrderedDict ([
+			("general", collections.OrderedDict ([
+				("id", { "type": "int" }),
+				("name", { "type": "str" }),
+			])),
+		]))
+
+		self.assertEqual (
+			yamlx.encode (base ["outer"], data),
+			layer_document)
+
+	def test_pickle_references (self):
+
+		base, top = layered_databases ()
+
+		top.record_class ("outer")
+
+		loaded = pickle.loads (pickle.dumps (top ["outer"], 2))
+
+		self.assertEqual (
+			[ field.name for field in loaded.field ("item").sub_schema.fields ],
+			[ "id", "name" ])
+
+		person = SchemaDatabase ()
+
+		person.read ("person", {
+			"general": {
+				"friend": { "type": "dict", "sub_schema": "person" },
+			},
+		})
+
+		loaded = pickle.loads (pickle.dumps (person ["person"], 2))
+
+		self.assertEqual (
+			loaded.field ("friend").sub_schema.field ("friend").name,
+			"friend")
+
+if __name__ == "__main__":
+	unittest.main ()
+
+# ex: noet ts=4 filetype=python
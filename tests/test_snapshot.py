@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import os
+import shutil
+import tempfile
+import unittest
+
+from wbs.data import deep_freeze
+from wbs.data import freeze
+from wbs.snapshot import SnapshotDict
+from wbs.snapshot import SnapshotList
+from wbs.snapshot import load_snapshot
+from wbs.snapshot import open_shared
+from wbs.snapshot import publish_shared
+from wbs.snapshot import save_snapshot
+from wbs.snapshot import unpublish_shared
+
+def sample_tree ():
+
+	return collections.OrderedDict ([
+		("unicode", "café"),
+		("bytes", b"raw\0bytes"),
+		("integers", [ 0, -1, int (2 ** 63 - 1), int (- 2 ** 63), 2 ** 70, - 2 ** 70 ]),
+		("scalars", [ True, False, None, 1, 1.0, 1.5, "1" ]),
+		("nested", collections.OrderedDict ([
+			("zebra", [ [], collections.OrderedDict (), [ [ "deep" ] ] ]),
+			("apple", collections.OrderedDict ([ (1, "int key") ])),
+		])),
+	])
+
+def describe (value):
+
+	# types and key order matter as well as equality
+
+	if isinstance (value, (dict, SnapshotDict)):
+
+		return (
+			"dict",
+			[
+				(describe (key), describe (item))
+				for key, item in value.items ()
+			],
+		)
+
+	if isinstance (value, (list, tuple, SnapshotList)):
+		return ("list", [ describe (item) for item in value ])
+
+	return (type (value).__name__, value)
+
+class SnapshotTest (unittest.TestCase):
+
+	def setUp (self):
+
+		self.directory = tempfile.mkdtemp ()
+		self.path = os.path.join (self.directory, "snapshot")
+
+	def tearDown (self):
+
+		shutil.rmtree (self.directory)
+
+	def round_trip (self, value, lazy):
+
+		save_snapshot (self.path, value)
+
+		return load_snapshot (self.path, lazy = lazy)
+
+	def test_round_trip (self):
+
+		tree = sample_tree ()
+
+		loaded = self.round_trip (tree, False)
+
+		self.assertIsInstance (loaded, collections.OrderedDict)
+		self.assertEqual (describe (loaded), describe (tree))
+
+	def test_lazy_round_trip (self):
+
+		tree = sample_tree ()
+
+		loaded = self.round_trip (tree, True)
+
+		self.assertIsInstance (loaded, SnapshotDict)
+		self.assertEqual (describe (loaded), describe (tree))
+		self.assertEqual (describe (loaded.thaw ()), describe (tree))
+
+	def test_lazy_access (self):
+
+		loaded = self.round_trip (sample_tree (), True)
+
+		self.assertEqual (list (loaded), list (sample_tree ()))
+		self.assertEqual (len (loaded), 5)
+		self.assertIn ("nested", loaded)
+		self.assertNotIn ("missing", loaded)
+
+		self.assertEqual (loaded ["nested"] ["apple"] [1], "int key")
+		self.assertEqual (loaded ["integers"] [-1], - 2 ** 70)
+		self.assertEqual (loaded ["scalars"] [1 : 3], [ False, None ])
+
+		self.assertEqual (
+			loaded.values () [0 : 2],
+			[ "café", b"raw\0bytes" ])
+
+		with self.assertRaises (KeyError):
+			loaded ["missing"]
+
+		with self.assertRaises (IndexError):
+			loaded ["scalars"] [7]
+
+	def test_list_equality (self):
+
+		loaded = self.round_trip ([ [ 1, 2 ], [] ], True)
+
+		self.assertEqual (loaded, [ [ 1, 2 ], [] ])
+		self.assertEqual (loaded [0], [ 1, 2 ])
+		self.assertNotEqual (loaded [0], [ 1, 2, 3 ])
+		self.assertNotEqual (loaded [0], [ 2, 1 ])
+		self.assertEqual (loaded [1], ())
+
+	def test_typed_scalars (self):
+
+		loaded = self.round_trip ([ 1, True, 1.0, "x", b"x" ], False)
+
+		self.assertEqual (
+			[ type (item) for item in loaded ],
+			[ int, bool, float, unicode, str ])
+
+	def test_frozen_values (self):
+
+		tree = sample_tree ()
+
+		self.assertEqual (
+			describe (self.round_trip (freeze (tree), False)),
+			describe (tree))
+
+		self.assertEqual (
+			describe (self.round_trip (deep_freeze (tree), False)),
+			describe (tree))
+
+	def test_unsupported_values (self):
+
+		with self.assertRaises (Exception):
+			save_snapshot (self.path, [ object () ])
+
+	def test_shared (self):
+
+		path = publish_shared (sample_tree ())
+
+		try:
+
+			loaded = open_shared (path)
+
+			self.assertEqual (describe (loaded), describe (sample_tree ()))
+
+		finally:
+			unpublish_shared (path)
+
+		self.assertFalse (os.path.exists (path))
+
+if __name__ == "__main__":
+	unittest.main ()
+
+# ex: noet ts=4 filetype=python
@@ -0,0 +1,154 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import wbs.watch as watch
+
+from wbs.watch import DataWatcher
+
+class PollingWatcherTest (unittest.TestCase):
+
+	use_inotify = False
+
+	def setUp (self):
+
+		self.directory = tempfile.mkdtemp ()
+
+		self.write ("top", "a: 1\n")
+		os.mkdir (os.path.join (self.directory, "hosts"))
+		self.write ("hosts/one", "name: one\n")
+
+		self.watcher = DataWatcher (
+			self.directory,
+			poll_interval = 0.05,
+			use_inotify = self.use_inotify)
+
+		self.changes = []
+		self.watcher.subscribe (self.changes.extend)
+
+	def tearDown (self):
+
+		self.watcher.close ()
+
+		shutil.rmtree (self.directory)
+
+	def write (self, name, text):
+
+		with open (os.path.join (self.directory, name), "w") as file_handle:
+			file_handle.write (text)
+
+	def wait_for (self, expected):
+
+		# inotify events and polled changes may arrive over several checks
+
+		deadline = time.time () + 5
+
+		while time.time () < deadline:
+
+			self.watcher.check (0.05)
+
+			if all (change in self.changes for change in expected):
+				return
+
+		self.fail ("expected %r but got %r" % (expected, self.changes))
+
+	def test_loads_tree (self):
+
+		self.assertEqual (self.watcher.tree ["top"], { "a": 1 })
+		self.assertEqual (self.watcher.tree ["hosts"] ["one"], { "name": "one" })
+
+	def test_modified (self):
+
+		self.write ("hosts/one", "name: changed\n")
+
+		self.wait_for ([ ("modified", ("hosts", "one")) ])
+
+		self.assertEqual (
+			self.watcher.tree ["hosts"] ["one"],
+			{ "name": "changed" })
+
+	def test_created_and_deleted (self):
+
+		self.write ("hosts/two", "name: two\n")
+		os.remove (os.path.join (self.directory, "top"))
+
+		self.wait_for ([
+			("created", ("hosts", "two")),
+			("deleted", ("top",)),
+		])
+
+		self.assertEqual (self.watcher.tree ["hosts"] ["two"], { "name": "two" })
+		self.assertNotIn ("top", self.watcher.tree)
+
+	def test_directories (self):
+
+		os.mkdir (os.path.join (self.directory, "new"))
+		self.write ("new/item", "x: 1\n")
+
+		self.wait_for ([
+			("created", ("new",)),
+			("created", ("new", "item")),
+		])
+
+		self.assertEqual (self.watcher.tree ["new"] ["item"], { "x": 1 })
+
+		shutil.rmtree (os.path.join (self.directory, "hosts"))
+
+		self.wait_for ([ ("deleted", ("hosts",)) ])
+
+		self.assertNotIn ("hosts", self.watcher.tree)
+
+	def test_invalid_file_is_retried (self):
+
+		self.write ("top", "a: [\n")
+
+		self.watcher.check (0.05)
+
+		self.assertEqual (self.watcher.tree ["top"], { "a": 1 })
+
+		self.write ("top", "a: 22\n")
+
+		self.wait_for ([ ("modified", ("top",)) ])
+
+		self.assertEqual (self.watcher.tree ["top"], { "a": 22 })
+
+	def test_background_thread (self):
+
+		changed = threading.Event ()
+
+		self.watcher.subscribe (lambda changes: changed.set ())
+		self.watcher.start ()
+
+		try:
+
+			self.write ("hosts/two", "name: two\n")
+
+			self.assertTrue (changed.wait (5))
+
+			with self.watcher.lock:
+				names = list (self.watcher.tree ["hosts"])
+
+			self.assertIn ("two", names)
+
+		finally:
+			self.watcher.stop ()
+
+@unittest.skipIf (
+	watch.libc is None,
+	"inotify is not available")
+class InotifyWatcherTest (PollingWatcherTest):
+
+	use_inotify = True
+
+if __name__ == "__main__":
+	unittest.main ()
+
+# ex: noet ts=4 filetype=python
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import codecs
+import collections
+import io
+import os
+import shutil
+import tempfile
+import textwrap
+import unittest
+
+import wbs.yamlx as yamlx
+
+documents = [
+
+	"""
+	name: plain
+	count: 3
+	ratio: 1.5
+	enabled: yes
+	nothing: ~
+	items: [ a, b, c ]
+	""",
+
+	"""
+	base: &base
+	  host: localhost
+	  port: 80
+	other: &other
+	  user: admin
+	merged:
+	  <<: *base
+	  port: 8080
+	multiple:
+	  <<: [ *base, *other ]
+	  extra: true
+	aliased: *base
+	""",
+
+	"""
+	zebra: 1
+	apple: 2
+	mango:
+	  zulu: 1
+	  alpha: 2
+	""",
+
+	"""
+	naïve: "café"
+	日本: [ "東京", "大阪" ]
+	escaped: "\\u00e9\\U0001F600"
+	""",
+
+]
+
+def unindent (text):
+
+	return textwrap.dedent (text)
+
+def describe (value):
+
+	# types and key order matter as well as equality
+
+	if isinstance (value, dict):
+
+		return (
+			type (value).__name__,
+			[
+				(describe (key), describe (item))
+				for key, item in value.items ()
+			],
+		)
+
+	if isinstance (value, list):
+
+		return (
+			"list",
+			[ describe (item) for item in value ],
+		)
+
+	return (type (value).__name__, value)
+
+@unittest.skipIf (
+	yamlx.CParser is None,
+	"LibYAML is not available")
+class LoaderEquivalenceTest (unittest.TestCase):
+
+	def assert_same (self, python_value, c_value):
+
+		self.assertEqual (
+			describe (python_value),
+			describe (c_value))
+
+	def test_parse_strings (self):
+
+		for document in documents:
+
+			text = unindent (document)
+
+			self.assert_same (
+				yamlx.parse (text, yamlx.OrderedDictYAMLLoader),
+				yamlx.parse (text, yamlx.OrderedDictYAMLCLoader))
+
+	def test_merge_keys (self):
+
+		value = yamlx.parse (
+			unindent (documents [1]),
+			yamlx.OrderedDictYAMLCLoader)
+
+		self.assertEqual (value ["merged"] ["port"], 8080)
+		self.assertEqual (value ["merged"] ["host"], "localhost")
+		self.assertEqual (value ["multiple"] ["user"], "admin")
+		self.assertEqual (value ["aliased"], value ["base"])
+
+	def test_key_order (self):
+
+		value = yamlx.parse (
+			unindent (documents [2]),
+			yamlx.OrderedDictYAMLCLoader)
+
+		self.assertIsInstance (value, collections.OrderedDict)
+		self.assertEqual (list (value), [ "zebra", "apple", "mango" ])
+		self.assertEqual (list (value ["mango"]), [ "zulu", "alpha" ])
+
+	def test_unicode_strings (self):
+
+		value = yamlx.parse (
+			unindent (documents [3]),
+			yamlx.OrderedDictYAMLCLoader)
+
+		self.assertEqual (value ["naïve"], "café")
+		self.assertIsInstance (value ["naïve"], unicode)
+
+	def test_codecs_handles (self):
+
+		directory = tempfile.mkdtemp ()
+
+		try:
+
+			path = os.path.join (directory, "document.yaml")
+
+			with codecs.open (path, "w", "utf-8") as file_handle:
+				file_handle.write (
+					"---\n".join ([
+						unindent (document)
+						for document in documents
+					]))
+
+			results = []
+
+			for loader in [
+				yamlx.OrderedDictYAMLLoader,
+				yamlx.OrderedDictYAMLCLoader,
+			]:
+
+				with codecs.open (path, "r", "utf-8") as file_handle:
+
+					results.append (
+						list (yamlx.iter_documents (file_handle, loader)))
+
+			self.assertEqual (len (results [0]), len (documents))
+			self.assert_same (results [0], results [1])
+
+		finally:
+
+			shutil.rmtree (directory)
+
+	def test_byte_and_text_streams (self):
+
+		text = unindent (documents [3])
+
+		for stream_class, data in [
+			(io.BytesIO, text.encode ("utf-8")),
+			(io.StringIO, text),
+		]:
+
+			self.assert_same (
+				yamlx.parse (stream_class (data), yamlx.OrderedDictYAMLLoader),
+				yamlx.parse (stream_class (data), yamlx.OrderedDictYAMLCLoader))
+
+	def test_iter_sequence (self):
+
+		text = unindent ("""
+		- &first { name: a, size: 1 }
+		- { <<: *first, name: b }
+		- "ü"
+		""")
+
+		self.assert_same (
+			list (yamlx.iter_sequence (text, yamlx.OrderedDictYAMLLoader)),
+			list (yamlx.iter_sequence (text, yamlx.OrderedDictYAMLCLoader)))
+
+if __name__ == "__main__":
+	unittest.main ()
+
+# ex: noet ts=4 filetype=python
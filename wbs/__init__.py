@@ -3,6 +3,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from wbs.columnar import *
 from wbs.data import *
 from wbs.env import *
 from wbs.error import *
@@ -11,9 +12,12 @@ from wbs.httpclient import *
 from wbs.lazy import *
 from wbs.login import *
 from wbs.output import *
+from wbs.persistent import *
 from wbs.project import *
+from wbs.query import *
 from wbs.random import *
 from wbs.schema import *
+from wbs.snapshot import *
 from wbs.table import *
 
 # ex: noet ts=4 filetype=python
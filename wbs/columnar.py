@@ -0,0 +1,397 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import array
+import collections
+import itertools
+
+from wbs.schema import schema_fields
+
+__all__ = [
+	"ColumnStore",
+]
+
+# code zero in every column means the record doesn't have the field
+
+MISSING_CODE = 0
+
+missing = object ()
+
+# a column holds one code per record, and each distinct value once. values
+# are keyed by class as well as value, so that True, 1 and 1.0 stay apart.
+# values which can't be hashed, lists and dictionaries, get a code each.
+# columns taken from another share its values, which only ever grow, so the
+# codes stay valid for both. the rows holding each code are worked out the
+# first time they are needed, and kept until the column changes
+
+class Column (object):
+
+	def __init__ (self, values = None, value_codes = None, codes = None):
+
+		if values is None:
+
+			values = [ missing ]
+			value_codes = {}
+
+		self.values = values
+		self.value_codes = value_codes
+
+		if codes is None:
+			codes = array.array (b"l")
+
+		self.codes = codes
+		self.rows = None
+
+	def encode (self, value):
+
+		if value is missing:
+			return MISSING_CODE
+
+		try:
+
+			value_key = (value.__class__, value)
+
+			code = self.value_codes.get (value_key)
+
+			if code is not None:
+				return code
+
+			code = self.value_codes [value_key] = len (self.values)
+
+		except TypeError:
+
+			code = len (self.values)
+
+		self.values.append (value)
+
+		return code
+
+	def code (self, value):
+
+		try:
+			return self.value_codes.get ((value.__class__, value))
+
+		except TypeError:
+			return None
+
+	def append (self, value):
+
+		self.codes.append (self.encode (value))
+		self.rows = None
+
+	def extend_missing (self, count):
+
+		self.codes.extend (
+			itertools.repeat (MISSING_CODE, count))
+
+		self.rows = None
+
+	def row_index (self):
+
+		if self.rows is not None:
+			return self.rows
+
+		codes = self.codes
+
+		self.rows = dict ([
+			(code, array.array (b"l", rows))
+			for code, rows in itertools.groupby (
+				sorted (xrange (len (codes)), key = codes.__getitem__),
+				codes.__getitem__)
+		])
+
+		return self.rows
+
+	def take (self, rows):
+
+		codes = self.codes
+
+		return Column (
+			self.values,
+			self.value_codes,
+			array.array (b"l", map (codes.__getitem__, rows)))
+
+	def copy (self):
+
+		return Column (
+			self.values,
+			self.value_codes,
+			array.array (b"l", self.codes))
+
+	def decode (self, default = None):
+
+		values = list (self.values)
+		values [MISSING_CODE] = default
+
+		return map (values.__getitem__, self.codes)
+
+# stores records as one column per field. filters and groupings work on the
+# codes, so a predicate only runs once for each distinct value, and records
+# are only turned back into dictionaries by to_dicts. fields the schema
+# doesn't list get a column the first time they are seen
+
+class ColumnStore (object):
+
+	def __init__ (self, schema = None, records = ()):
+
+		self.names = []
+		self.columns = {}
+		self.count = 0
+
+		if schema is not None:
+
+			for field in schema_fields (schema):
+				self.add_column (field.name)
+
+		self.extend (records)
+
+	def append (self, record):
+
+		for name in record:
+
+			if name not in self.columns:
+				self.add_column (name)
+
+		for name in self.names:
+			self.columns [name].append (record.get (name, missing))
+
+		self.count += 1
+
+	def extend (self, records):
+
+		for record in records:
+			self.append (record)
+
+	def add_column (self, name):
+
+		column = self.columns [name] = Column ()
+
+		self.names.append (name)
+
+		column.extend_missing (self.count)
+
+		return column
+
+	def iter_columns (self):
+
+		for name in self.names:
+			yield name, self.columns [name]
+
+	def __len__ (self):
+
+		return self.count
+
+	def __iter__ (self):
+
+		return iter (self.to_dicts ())
+
+	def __getitem__ (self, row):
+
+		return self.record (row)
+
+	def record (self, row):
+
+		if row < 0:
+			row += self.count
+
+		if not 0 <= row < self.count:
+			raise IndexError (row)
+
+		return collections.OrderedDict ([
+			(name, column.values [column.codes [row]])
+			for name, column in self.iter_columns ()
+			if column.codes [row] != MISSING_CODE
+		])
+
+	def to_dicts (self):
+
+		records = [
+			collections.OrderedDict ()
+			for row in xrange (self.count)
+		]
+
+		for name, column in self.iter_columns ():
+
+			values = column.values
+
+			for record, code in itertools.izip (records, column.codes):
+
+				if code != MISSING_CODE:
+					record [name] = values [code]
+
+		return records
+
+	def column (self, name, default = None):
+
+		return self.columns [name].decode (default)
+
+	def distinct (self, name):
+
+		column = self.columns [name]
+
+		return [
+			column.values [code]
+			for code in sorted (column.row_index ())
+			if code != MISSING_CODE
+		]
+
+	def take (self, rows):
+
+		rows = list (rows)
+
+		store = ColumnStore ()
+		store.count = len (rows)
+
+		store.names = list (self.names)
+
+		for name, column in self.iter_columns ():
+			store.columns [name] = column.take (rows)
+
+		return store
+
+	def select (self, mask):
+
+		return self.take (
+			itertools.compress (
+				xrange (self.count),
+				mask))
+
+	def filter (self, name, predicate):
+
+		# the predicate is called once per distinct value, missing fields
+		# never match
+
+		column = self.columns [name]
+
+		matches = [ False ] + [
+			bool (predicate (value))
+			for value in column.values [1 :]
+		]
+
+		return self.select (
+			map (matches.__getitem__, column.codes))
+
+	def where (self, name, value):
+
+		column = self.columns [name]
+
+		code = column.code (value)
+
+		if code is None:
+
+			return self.filter (
+				name,
+				lambda item:
+					type (item) is type (value) and item == value)
+
+		return self.take (
+			column.row_index ().get (code, ()))
+
+	def project (self, names):
+
+		store = ColumnStore ()
+		store.count = self.count
+
+		store.names = list (names)
+
+		for name in names:
+			store.columns [name] = self.columns [name].copy ()
+
+		return store
+
+	# groupings return lists of (value, result) pairs in the order values were
+	# first seen, rather than dictionaries, since values the column keeps
+	# apart like True and 1 would collide as keys, and lists can't be keys
+
+	def group_rows (self, name):
+
+		column = self.columns [name]
+
+		groups = []
+		merged_rows = {}
+
+		for code, rows in sorted (column.row_index ().items ()):
+
+			if code == MISSING_CODE:
+				continue
+
+			value = column.values [code]
+
+			if column.code (value) is not None:
+
+				groups.append ((value, rows))
+
+				continue
+
+			# unhashable values have a code each, so equal ones are merged here
+
+			for group_index in merged_rows:
+
+				group_value = groups [group_index] [0]
+
+				if type (group_value) is type (value) \
+				and group_value == value:
+
+					merged_rows [group_index].append (rows)
+
+					break
+
+			else:
+
+				merged_rows [len (groups)] = [ rows ]
+				groups.append ((value, rows))
+
+		for group_index, row_arrays in merged_rows.items ():
+
+			if len (row_arrays) == 1:
+				continue
+
+			groups [group_index] = (
+				groups [group_index] [0],
+				array.array (
+					b"l",
+					sorted (itertools.chain.from_iterable (row_arrays))))
+
+		return groups
+
+	def group_by (self, name):
+
+		return [
+			(value, self.take (rows))
+			for value, rows in self.group_rows (name)
+		]
+
+	def count_by (self, name):
+
+		return [
+			(value, len (rows))
+			for value, rows in self.group_rows (name)
+		]
+
+	def sum (self, name):
+
+		return sum ([
+			value * len (rows)
+			for value, rows in self.group_rows (name)
+		])
+
+	def sum_by (self, group_name, name):
+
+		column = self.columns [name]
+
+		values = list (column.values)
+		values [MISSING_CODE] = 0
+
+		codes = column.codes
+
+		return [
+			(
+				group_value,
+				sum (map (values.__getitem__, map (codes.__getitem__, rows))),
+			)
+			for group_value, rows in self.group_rows (group_name)
+		]
+
+# ex: noet ts=4 filetype=python
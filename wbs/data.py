@@ -4,20 +4,34 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import collections
+import hashlib
 
 __all__ = [
 	"freeze",
+	"deep_freeze",
 	"deep_copy",
+	"fingerprint",
+	"same_content",
+	"diff",
+	"apply_patch",
+	"ImmutableDict",
+	"ImmutableTuple",
 ]
 
-immutable_types = set ([ int, str, unicode ])
+private_attributes = set ([
+	"_value",
+	"_children",
+])
 
 class Frozen (object):
 
 	acceptable_attributes = set ([
 		"_value",
+		"_children",
 	])
 
+	_children = None
+
 	def __init__ (self, value):
 
 		self._value = value
@@ -32,7 +46,7 @@ class Frozen (object):
 
 	def __setattr__ (self, name, value):
 
-		if name == "_value":
+		if name in private_attributes:
 			super (Frozen, self).__setattr__ (name, value)
 
 		else:
@@ -41,12 +55,12 @@ class Frozen (object):
 
 	def __iter__ (self):
 
-		for item in self._value:
-			yield freeze (item)
+		for index, item in enumerate (self._value):
+			yield freeze_child (self, index, item)
 
 	def __getitem__ (self, key):
 
-		return freeze (self._value [key])
+		return freeze_child (self, key, self._value [key])
 
 	def __str__ (self):
 
@@ -56,8 +70,11 @@ class FrozenList (list):
 
 	acceptable_attributes = set ([
 		"_value",
+		"_children",
 	])
 
+	_children = None
+
 	def __init__ (self, value):
 
 		self._value = value
@@ -72,7 +89,7 @@ class FrozenList (list):
 
 	def __setattr__ (self, name, value):
 
-		if name == "_value":
+		if name in private_attributes:
 			super (FrozenList, self).__setattr__ (name, value)
 
 		else:
@@ -81,16 +98,16 @@ class FrozenList (list):
 
 	def __iter__ (self):
 
-		for item in self._value:
-			yield freeze (item)
+		for index, item in enumerate (self._value):
+			yield freeze_child (self, index, item)
 
 	def __getitem__ (self, key):
 
-		return freeze (self._value [key])
+		return freeze_child (self, key, self._value [key])
 
 	def get (self, key, default):
 
-		return freeze (self._value.get (key, default))
+		return freeze_child (self, key, self._value.get (key, default))
 
 	def __str__ (self):
 
@@ -100,6 +117,7 @@ class FrozenDict (dict):
 
 	acceptable_attributes = set ([
 		"_value",
+		"_children",
 		"__class__",
 		"get",
 		"keys",
@@ -107,6 +125,8 @@ class FrozenDict (dict):
 		"values",
 	])
 
+	_children = None
+
 	def __init__ (self, value):
 
 		self._value = value
@@ -121,7 +141,7 @@ class FrozenDict (dict):
 
 	def __setattr__ (self, name, value):
 
-		if name == "_value":
+		if name in private_attributes:
 			super (FrozenDict, self).__setattr__ (name, value)
 
 		else:
@@ -136,7 +156,7 @@ class FrozenDict (dict):
 
 	def __getitem__ (self, key):
 
-		return freeze (self._value [key])
+		return freeze_child (self, key, self._value [key])
 
 	def __setitem__ (self, key, value):
 
@@ -169,7 +189,7 @@ class FrozenDict (dict):
 
 	def get (self, key, default):
 
-		return freeze (self._value.get (key, default))
+		return freeze_child (self, key, self._value.get (key, default))
 
 	def keys (self):
 
@@ -181,15 +201,15 @@ class FrozenDict (dict):
 	def items (self):
 
 		return [
-			(freeze (key), freeze (value))
+			(freeze (key), freeze_child (self, key, value))
 			for key, value in self._value.items ()
 		]
 
 	def values (self):
 
 		return [
-			freeze (value)
-			for value in self._value.values ()
+			freeze_child (self, key, value)
+			for key, value in self._value.items ()
 		]
 
 	def pop (self):
@@ -212,6 +232,7 @@ class FrozenOrderedDict (collections.OrderedDict):
 
 	acceptable_attributes = set ([
 		"_value",
+		"_children",
 		"__class__",
 		"get",
 		"keys",
@@ -219,6 +240,8 @@ class FrozenOrderedDict (collections.OrderedDict):
 		"values",
 	])
 
+	_children = None
+
 	def __init__ (self, value):
 
 		self._value = value
@@ -233,7 +256,7 @@ class FrozenOrderedDict (collections.OrderedDict):
 
 	def __setattr__ (self, name, value):
 
-		if name == "_value":
+		if name in private_attributes:
 			super (FrozenOrderedDict, self).__setattr__ (name, value)
 
 		else:
@@ -248,7 +271,7 @@ class FrozenOrderedDict (collections.OrderedDict):
 
 	def __getitem__ (self, key):
 
-		return freeze (self._value [key])
+		return freeze_child (self, key, self._value [key])
 
 	def __setitem__ (self, key, value):
 
@@ -281,7 +304,7 @@ class FrozenOrderedDict (collections.OrderedDict):
 
 	def get (self, key, default):
 
-		return freeze (self._value.get (key, default))
+		return freeze_child (self, key, self._value.get (key, default))
 
 	def keys (self):
 
@@ -293,15 +316,15 @@ class FrozenOrderedDict (collections.OrderedDict):
 	def items (self):
 
 		return [
-			(freeze (key), freeze (value))
+			(freeze (key), freeze_child (self, key, value))
 			for key, value in self._value.items ()
 		]
 
 	def values (self):
 
 		return [
-			freeze (value)
-			for value in self._value.values ()
+			freeze_child (self, key, value)
+			for key, value in self._value.items ()
 		]
 
 	def pop (self):
@@ -320,6 +343,150 @@ class FrozenOrderedDict (collections.OrderedDict):
 
 		return str (self._value)
 
+# read only, ordered dictionary produced by deep_freeze. lookups go straight
+# to the underlying dict, and values are already frozen so are returned as is.
+# every method which would modify it raises, but calling dict's own methods
+# directly, such as dict.update (value, ...), still gets through, and leaves
+# the keys out of step with the key order
+
+class ImmutableDict (dict):
+
+	__slots__ = [
+		"_keys",
+		"_digest",
+		"_order_digest",
+	]
+
+	def __init__ (self, items = ()):
+
+		# dict.__init__ adds to an existing dictionary, so only allow it once
+
+		try:
+			self._keys
+
+		except AttributeError:
+			pass
+
+		else:
+
+			raise Exception (
+				"Can't modify frozen dictionary")
+
+		items = list (items)
+
+		dict.__init__ (self, items)
+
+		self._digest = None
+		self._order_digest = None
+
+		self._keys = tuple ([
+			key
+			for key, value in items
+		])
+
+	def __setitem__ (self, key, value):
+
+		raise Exception (
+			"Can't modify frozen dictionary")
+
+	def __delitem__ (self, key):
+
+		raise Exception (
+			"Can't modify frozen dictionary")
+
+	def __iter__ (self):
+
+		return iter (self._keys)
+
+	def __reversed__ (self):
+
+		return reversed (self._keys)
+
+	def __reduce__ (self):
+
+		return (ImmutableDict, (self.items (),))
+
+	def __repr__ (self):
+
+		return "ImmutableDict (%r)" % self.items ()
+
+	def keys (self):
+
+		return list (self._keys)
+
+	def iterkeys (self):
+
+		return iter (self._keys)
+
+	def values (self):
+
+		return [
+			dict.__getitem__ (self, key)
+			for key in self._keys
+		]
+
+	def itervalues (self):
+
+		for key in self._keys:
+			yield dict.__getitem__ (self, key)
+
+	def items (self):
+
+		return [
+			(key, dict.__getitem__ (self, key))
+			for key in self._keys
+		]
+
+	def iteritems (self):
+
+		for key in self._keys:
+			yield key, dict.__getitem__ (self, key)
+
+	def copy (self):
+
+		return self
+
+	def clear (self):
+
+		raise Exception (
+			"Can't modify frozen dictionary")
+
+	def pop (self, * arguments):
+
+		raise Exception (
+			"Can't modify frozen dictionary")
+
+	def popitem (self):
+
+		raise Exception (
+			"Can't modify frozen dictionary")
+
+	def setdefault (self, * arguments):
+
+		raise Exception (
+			"Can't modify frozen dictionary")
+
+	def update (self, * arguments, ** kwarguments):
+
+		raise Exception (
+			"Can't modify frozen dictionary")
+
+# the frozen form of lists and tuples. it behaves exactly as a tuple, and is
+# only there to give the digests somewhere to be cached. tuple subclasses
+# can't have slots, but the instance dictionary isn't created until a digest
+# is first set
+
+class ImmutableTuple (tuple):
+
+	_digest = None
+	_order_digest = None
+
+	def __reduce__ (self):
+
+		return (ImmutableTuple, (tuple (self),))
+
+immutable_types = set ([ int, str, unicode, ImmutableDict, ImmutableTuple ])
+
 def freeze (value):
 
 	if value.__class__ in immutable_types:
@@ -337,31 +504,861 @@ def freeze (value):
 	else:
 		return Frozen (value)
 
-def deep_copy (value):
+# frozen proxies remember the proxy they handed out for each key, so reading
+# the same child twice gives the same proxy, as long as the parent proxy is
+# still around. the child's value is checked on every read, so an entry is
+# replaced once the underlying data changes, and the proxies only hold values
+# their parent already holds
 
-	if isinstance (value, unicode):
-		return value
+get_private = object.__getattribute__
+set_private = object.__setattr__
 
-	if isinstance (value, str):
+def freeze_child (parent, key, value):
+
+	if value.__class__ in immutable_types:
 		return value
 
-	if isinstance (value, int):
+	children = get_private (parent, "_children")
+
+	if children is None:
+
+		children = {}
+
+		set_private (parent, "_children", children)
+
+	try:
+		child = children.get (key)
+
+	except TypeError:
+		return freeze (value)
+
+	if child is None \
+	or get_private (child, "_value") is not value:
+
+		child = children [key] = freeze (value)
+
+	return child
+
+def deep_freeze (value):
+
+	if value.__class__ in immutable_types:
 		return value
 
 	if isinstance (value, dict):
 
-		return collections.OrderedDict ([
-			(key, deep_copy (item))
+		return ImmutableDict ([
+			(key, deep_freeze (item))
 			for key, item in value.items ()
 		])
 
-	if isinstance (value, list):
+	if isinstance (value, (list, tuple)):
 
-		return [
-			deep_copy (item)
+		return ImmutableTuple ([
+			deep_freeze (item)
 			for item in value
+		])
+
+	if value is None \
+	or isinstance (value, (long, float, bool)):
+		return value
+
+	raise Exception (
+		"Can't deep freeze %s" % type (value))
+
+# deep_copy dispatches on the exact class of each value, falling back to
+# isinstance checks for subclasses, and walks the tree with an explicit stack
+# so deep trees don't hit the recursion limit
+
+COPY_SCALAR = 0
+COPY_DICT = 1
+COPY_LIST = 2
+COPY_MATERIALIZE = 3
+
+copy_kinds = {
+	type (None): COPY_SCALAR,
+	bool: COPY_SCALAR,
+	int: COPY_SCALAR,
+	long: COPY_SCALAR,
+	float: COPY_SCALAR,
+	str: COPY_SCALAR,
+	unicode: COPY_SCALAR,
+	dict: COPY_DICT,
+	collections.OrderedDict: COPY_DICT,
+	ImmutableDict: COPY_DICT,
+	ImmutableTuple: COPY_LIST,
+	list: COPY_LIST,
+	tuple: COPY_LIST,
+}
+
+# with share = True, deep frozen dictionaries and tuples are reused rather than
+# copied
+
+shared_copy_kinds = dict (copy_kinds)
+shared_copy_kinds [ImmutableDict] = COPY_SCALAR
+shared_copy_kinds [ImmutableTuple] = COPY_SCALAR
+
+def copy_kind (value, kinds):
+
+	value_class = value.__class__
+
+	if value_class in kinds:
+		return kinds [value_class]
+
+	if isinstance (value, (int, long, float, str, unicode)):
+		kind = COPY_SCALAR
+
+	elif isinstance (value, dict):
+		kind = COPY_DICT
+
+	elif isinstance (value, (list, tuple)):
+		kind = COPY_LIST
+
+	elif isinstance (value, CopyOnWrite):
+		kind = COPY_MATERIALIZE
+
+	else:
+
+		raise Exception (
+			"Can't copy %s" % type (value))
+
+	kinds [value_class] = kind
+
+	return kind
+
+def deep_copy (value, lazy = False, share = False):
+
+	if lazy:
+		return lazy_copy (value)
+
+	kinds = shared_copy_kinds if share else copy_kinds
+
+	kind = copy_kind (value, kinds)
+
+	if kind == COPY_SCALAR:
+		return value
+
+	if kind == COPY_MATERIALIZE:
+		return value.materialize ()
+
+	if kind == COPY_DICT:
+		root = collections.OrderedDict ()
+
+	else:
+		root = []
+
+	stack = [ (value, root) ]
+
+	while stack:
+
+		source, target = stack.pop ()
+
+		if target.__class__ is list:
+
+			append = target.append
+
+			for item in source:
+
+				kind = copy_kind (item, kinds)
+
+				if kind == COPY_SCALAR:
+					append (item)
+
+				elif kind == COPY_DICT:
+
+					child = collections.OrderedDict ()
+
+					append (child)
+					stack.append ((item, child))
+
+				elif kind == COPY_LIST:
+
+					child = []
+
+					append (child)
+					stack.append ((item, child))
+
+				else:
+					append (item.materialize ())
+
+		else:
+
+			for key, item in source.items ():
+
+				kind = copy_kind (item, kinds)
+
+				if kind == COPY_SCALAR:
+					target [key] = item
+
+				elif kind == COPY_DICT:
+
+					child = target [key] = collections.OrderedDict ()
+
+					stack.append ((item, child))
+
+				elif kind == COPY_LIST:
+
+					child = target [key] = []
+
+					stack.append ((item, child))
+
+				else:
+					target [key] = item.materialize ()
+
+	return root
+
+# copy on write proxies returned by deep_copy (value, lazy = True). reads go
+# through to the original, and a node only takes a private shallow copy, as
+# do all of its ancestors, the first time it is modified. materialize ()
+# returns an ordinary deep copy of the current state.
+
+class CopyOnWrite (object):
+
+	def __init__ (self, source, parent = None):
+
+		self._source = source
+		self._copy = None
+		self._children = {}
+		self._parent = parent
+
+	def _current (self):
+
+		if self._copy is None:
+			return self._source
+
+		return self._copy
+
+	def _wrap (self, key, value):
+
+		if not isinstance (value, (dict, list)):
+			return value
+
+		if self._copy is not None:
+
+			child = self._copy [key] = (
+				copy_on_write (value, self))
+
+			return child
+
+		child = self._children.get (key)
+
+		if child is None or child._source is not value:
+
+			child = self._children [key] = (
+				copy_on_write (value, self))
+
+		return child
+
+	def _materialize (self):
+
+		if self._copy is not None:
+			return
+
+		copy = self._shallow_copy ()
+
+		for key, child in self._children.items ():
+			copy [key] = child
+
+		self._copy = copy
+		self._children = None
+
+		if self._parent is not None:
+
+			parent = self._parent
+			self._parent = None
+
+			parent._materialize ()
+
+	def _materialize_items (self):
+
+		current = self._current ()
+
+		for key in self._keys ():
+
+			if self._copy is None and key in self._children:
+				yield key, materialize (self._children [key])
+
+			else:
+				yield key, materialize (current [key])
+
+class CopyOnWriteDict (CopyOnWrite, collections.MutableMapping):
+
+	def _shallow_copy (self):
+
+		return collections.OrderedDict (self._source.items ())
+
+	def _keys (self):
+
+		return list (self._current ())
+
+	def __getitem__ (self, key):
+
+		return self._wrap (key, self._current () [key])
+
+	def __setitem__ (self, key, value):
+
+		self._materialize ()
+		self._copy [key] = value
+
+	def __delitem__ (self, key):
+
+		self._materialize ()
+		del self._copy [key]
+
+	def __contains__ (self, key):
+
+		return key in self._current ()
+
+	def __iter__ (self):
+
+		return iter (self._current ())
+
+	def __len__ (self):
+
+		return len (self._current ())
+
+	def materialize (self):
+
+		return collections.OrderedDict (
+			self._materialize_items ())
+
+class CopyOnWriteList (CopyOnWrite, collections.MutableSequence):
+
+	def _shallow_copy (self):
+
+		return list (self._source)
+
+	def _keys (self):
+
+		return range (len (self._current ()))
+
+	def __getitem__ (self, index):
+
+		if isinstance (index, slice):
+
+			return [
+				self [item_index]
+				for item_index in xrange (* index.indices (len (self)))
+			]
+
+		if index < 0:
+			index += len (self)
+
+		return self._wrap (index, self._current () [index])
+
+	def __setitem__ (self, index, value):
+
+		self._materialize ()
+		self._copy [index] = value
+
+	def __delitem__ (self, index):
+
+		self._materialize ()
+		del self._copy [index]
+
+	def __len__ (self):
+
+		return len (self._current ())
+
+	def __eq__ (self, other):
+
+		if not isinstance (other, (list, collections.Sequence)):
+			return NotImplemented
+
+		return len (self) == len (other) and all (
+			mine == theirs
+			for mine, theirs in zip (self, other))
+
+	def __ne__ (self, other):
+
+		return not self == other
+
+	def insert (self, index, value):
+
+		self._materialize ()
+		self._copy.insert (index, value)
+
+	def materialize (self):
+
+		return [
+			value
+			for key, value in self._materialize_items ()
 		]
 
-	raise Exception ()
+def copy_on_write (value, parent = None):
+
+	if isinstance (value, CopyOnWrite):
+		return value
+
+	if isinstance (value, dict):
+		return CopyOnWriteDict (value, parent)
+
+	if isinstance (value, list):
+		return CopyOnWriteList (value, parent)
+
+	return deep_copy (value)
+
+def lazy_copy (value):
+
+	# a copy of a proxy gets a proxy of its own. an unmodified proxy's source
+	# is still the current state, anything else has to be copied now so that
+	# later changes to either side aren't seen by the other
+
+	if isinstance (value, CopyOnWrite):
+
+		if value._copy is None:
+			value = value._source
+
+		else:
+			value = value.materialize ()
+
+	return copy_on_write (value)
+
+def materialize (value):
+
+	if isinstance (value, CopyOnWrite):
+		return value.materialize ()
+
+	return deep_copy (value)
+
+# content fingerprints. a digest is a 160 bit sha1 value. mappings and lists
+# combine the digests of their entries by addition, so a single entry can be
+# swapped out of a combined digest without looking at the others. digests are
+# cached on deep frozen dictionaries and tuples, and persistent containers keep them up
+# to date as they evolve.
+#
+# digests describe content, which is not the same as python equality:
+#
+# - mappings are unordered, so ordered dictionaries holding the same items in
+#   a different order have the same digest, although they compare unequal
+# - scalars are typed, so True, 1 and 1.0 all have different digests,
+#   although they compare equal. str and unicode with the same text match
+# - any sequence, list or tuple, with the same items has the same digest
+#
+# same_content and fingerprint compare content in this sense. code which
+# needs key order or python equality should compare the values directly
+
+DIGEST_MODULUS = 1 << 160
+
+frozen_proxy_types = set ([
+	Frozen,
+	FrozenList,
+	FrozenDict,
+	FrozenOrderedDict,
+])
+
+def sha1_int (data):
+
+	return int (hashlib.sha1 (data).hexdigest (), 16)
+
+def scalar_digest (value):
+
+	if value is None:
+		return sha1_int (b"z")
+
+	if value is True or value is False:
+		return sha1_int (b"b%d" % value)
+
+	if isinstance (value, unicode):
+		return sha1_int (b"s" + value.encode ("utf-8"))
+
+	if isinstance (value, str):
+		return sha1_int (b"s" + value)
+
+	if isinstance (value, (int, long)):
+		return sha1_int (b"i%d" % value)
+
+	if isinstance (value, float):
+		return sha1_int (b"f" + repr (value).encode ("ascii"))
+
+	raise Exception (
+		"Can't fingerprint %s" % type (value))
+
+def pair_digest (key_digest, value_digest):
+
+	return sha1_int (b"k%x:%x" % (key_digest, value_digest))
+
+def item_digest (index, value_digest):
+
+	return sha1_int (b"p%d:%x" % (index, value_digest))
+
+def mapping_digest (total, count):
+
+	return sha1_int (b"d%x:%d" % (total, count))
+
+def sequence_digest (total, count):
+
+	return sha1_int (b"l%x:%d" % (total, count))
+
+def content_digest (value):
+
+	if type (value) in frozen_proxy_types:
+		value = get_private (value, "_value")
+
+	if isinstance (value, ImmutableDict):
+
+		if value._digest is None:
+			value._digest = dict_digest (value)
+
+		return value._digest
+
+	if isinstance (value, ImmutableTuple):
+
+		if value._digest is None:
+			value._digest = list_digest (value)
+
+		return value._digest
+
+	if isinstance (value, (str, unicode)):
+		return scalar_digest (value)
+
+	value_digest = getattr (value, "content_digest", None)
+
+	if value_digest is not None:
+		return value_digest ()
+
+	if isinstance (value, collections.Mapping):
+		return dict_digest (value)
+
+	if isinstance (value, collections.Sequence):
+		return list_digest (value)
+
+	return scalar_digest (value)
+
+def dict_digest (value):
+
+	return mapping_digest (
+		sum ([
+			pair_digest (
+				content_digest (key),
+				content_digest (item))
+			for key, item in value.items ()
+		]) % DIGEST_MODULUS,
+		len (value))
+
+def list_digest (value):
+
+	return sequence_digest (
+		sum ([
+			item_digest (index, content_digest (item))
+			for index, item in enumerate (value)
+		]) % DIGEST_MODULUS,
+		len (value))
+
+def fingerprint (value):
+
+	return "%040x" % content_digest (value)
+
+def same_content (left, right):
+
+	return left is right \
+		or content_digest (left) == content_digest (right)
+
+# diff returns the operations which turn one tree into another, as a list of
+# ("add", path, value), ("remove", path) and ("replace", path, value) tuples,
+# where path is the tuple of keys and list indexes leading to the value. key
+# order matters for every mapping except plain dictionaries, and where it
+# differs once the other operations are done a ("reorder", path, keys) tuple
+# gives the mapping's new key order. the operations are ordered so that
+# apply_patch can replay them one at a time
+
+def cached_digest (value):
+
+	# only digests which are already known, working them out would cost as
+	# much as comparing the values
+
+	if isinstance (value, (ImmutableDict, ImmutableTuple)):
+		return value._digest
+
+	if getattr (value, "digest_total", None) is not None:
+		return value.content_digest ()
+
+	return None
+
+def is_ordered (value):
+
+	return type (value) is not dict
+
+# digests ignore key order, so when two digests match diff still has to
+# check the order of keys. order digests cover just that, and are cached
+# where content digests are, so subtrees with the same content and the same
+# order are skipped without being walked. they are only compared between
+# values whose content digests match, so the keys are known to be the same
+# and only their order needs to go in. values which don't cache them are
+# never asked for one
+
+unordered_types = set ([
+	type (None),
+	bool,
+	int,
+	long,
+	float,
+	str,
+	unicode,
+])
+
+def cached_order_digest (value):
+
+	if value.__class__ is ImmutableDict \
+	or value.__class__ is ImmutableTuple:
+
+		if value._order_digest is None:
+			value._order_digest = order_digest (value)
+
+		return value._order_digest
+
+	value_digest = getattr (value, "order_digest", None)
+
+	if value_digest is not None:
+		return value_digest ()
+
+	return None
+
+def order_digest (value):
+
+	if isinstance (value, collections.Mapping):
+
+		entries = [
+			b"%s=%x" % (repr (key), child_order_digest (item))
+			for key, item in value.items ()
+		]
+
+		if not is_ordered (value):
+			entries.sort ()
+
+		return sha1_int (b"o" + b",".join (entries))
+
+	if is_sequence (value):
+
+		return sha1_int (
+			b"q" + b",".join ([
+				b"%x" % child_order_digest (item)
+				for item in value
+			]))
+
+	return 0
+
+def child_order_digest (value):
+
+	if value.__class__ in unordered_types:
+		return 0
+
+	value_digest = cached_order_digest (value)
+
+	if value_digest is not None:
+		return value_digest
+
+	return order_digest (value)
+
+def is_sequence (value):
+
+	return isinstance (value, collections.Sequence) \
+		and not isinstance (value, (str, unicode))
+
+def diff (old, new):
+
+	operations = []
+
+	diff_value (operations, (), old, new)
+
+	return operations
+
+def diff_value (operations, path, old, new):
+
+	if type (old) in frozen_proxy_types:
+		old = get_private (old, "_value")
+
+	if type (new) in frozen_proxy_types:
+		new = get_private (new, "_value")
+
+	if old is new:
+		return
+
+	old_digest = cached_digest (old)
+
+	if old_digest is not None \
+	and old_digest == cached_digest (new):
+
+		# the content is the same but the order of keys might not be
+
+		diff_order (operations, path, old, new)
+
+		return
+
+	if isinstance (old, collections.Mapping) \
+	and isinstance (new, collections.Mapping):
+
+		diff_mapping (operations, path, old, new)
+
+	elif is_sequence (old) and is_sequence (new):
+
+		diff_sequence (operations, path, old, new)
+
+	elif type (old) is not type (new) \
+	or old != new:
+
+		operations.append (("replace", path, new))
+
+def diff_mapping (operations, path, old, new):
+
+	for key, old_item in old.items ():
+
+		if key in new:
+
+			diff_value (
+				operations,
+				path + (key,),
+				old_item,
+				new [key])
+
+		else:
+
+			operations.append (("remove", path + (key,)))
+
+	for key, new_item in new.items ():
+
+		if key not in old:
+			operations.append (("add", path + (key,), new_item))
+
+	if not is_ordered (new):
+		return
+
+	# added keys end up at the end
+
+	patched_keys = [
+		key
+		for key in old
+		if key in new
+	] + [
+		key
+		for key in new
+		if key not in old
+	]
+
+	new_keys = list (new)
+
+	if patched_keys != new_keys:
+		operations.append (("reorder", path, new_keys))
+
+def diff_order (operations, path, old, new):
+
+	if old is new:
+		return
+
+	old_digest = cached_order_digest (old)
+
+	if old_digest is not None \
+	and old_digest == cached_order_digest (new):
+		return
+
+	if isinstance (old, collections.Mapping) \
+	and isinstance (new, collections.Mapping):
+
+		new_keys = list (new)
+
+		if is_ordered (new) \
+		and list (old) != new_keys:
+			operations.append (("reorder", path, new_keys))
+
+		for key, new_item in new.items ():
+
+			diff_order (
+				operations,
+				path + (key,),
+				old [key],
+				new_item)
+
+	elif is_sequence (old) and is_sequence (new):
+
+		for index, (old_item, new_item) in enumerate (zip (old, new)):
+
+			diff_order (
+				operations,
+				path + (index,),
+				old_item,
+				new_item)
+
+def diff_sequence (operations, path, old, new):
+
+	for index in xrange (min (len (old), len (new))):
+
+		diff_value (
+			operations,
+			path + (index,),
+			old [index],
+			new [index])
+
+	for index in xrange (len (old), len (new)):
+		operations.append (("add", path + (index,), new [index]))
+
+	# remove from the end so the remaining indexes stay valid
+
+	for index in reversed (xrange (len (new), len (old))):
+		operations.append (("remove", path + (index,)))
+
+def apply_patch (tree, patch):
+
+	# modifies the tree in place and returns it, or returns the new root when
+	# an operation replaces the whole tree
+
+	for operation in patch:
+
+		action, path = operation [0 : 2]
+
+		if action == "reorder":
+
+			mapping = tree
+
+			for name in path:
+				mapping = mapping [name]
+
+			items = [
+				(key, mapping [key])
+				for key in operation [2]
+			]
+
+			mapping.clear ()
+			mapping.update (items)
+
+			continue
+
+		if not path:
+
+			if action == "remove":
+				tree = None
+
+			else:
+				tree = operation [2]
+
+			continue
+
+		parent = tree
+
+		for name in path [: -1]:
+			parent = parent [name]
+
+		key = path [-1]
+
+		if action == "add":
+
+			if isinstance (parent, list):
+				parent.insert (key, operation [2])
+
+			else:
+				parent [key] = operation [2]
+
+		elif action == "replace":
+
+			parent [key] = operation [2]
+
+		elif action == "remove":
+
+			del parent [key]
+
+		else:
+
+			raise Exception (
+				"Invalid patch operation %s" % action)
+
+	return tree
 
 # ex: noet ts=4 filetype=pyton
@@ -3,6 +3,20 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
+import sys
+import threading
+import time
+
+__all__ = [
+	"lazy_property",
+	"thread_safe_lazy_property",
+	"LazyDictionary",
+	"ThreadSafeLazyDictionary",
+]
+
+missing = object ()
+
 class lazy_property (object):
 
 	def __init__ (self, getter):
@@ -24,22 +38,372 @@ class lazy_property (object):
 
 		return value
 
+# only one thread runs the getter for each object, any others asking at the
+# same time wait for its result. if the getter raises, every waiting thread
+# gets the exception and nothing is stored, so the next access tries again
+
+class thread_safe_lazy_property (lazy_property):
+
+	def __init__ (self, getter):
+
+		lazy_property.__init__ (self, getter)
+
+		self.lock = threading.Lock ()
+		self.flights = dict ()
+
+	def __get__ (self, target, target_class):
+
+		if target is None:
+			return None
+
+		target_dict = vars (target)
+		flight_key = id (target)
+
+		with self.lock:
+
+			# another thread may have stored the value since the attribute
+			# lookup which got us here
+
+			if self.name in target_dict:
+				return target_dict [self.name]
+
+			flight = self.flights.get (flight_key)
+
+			if flight is not None:
+				leader = False
+
+			else:
+				flight = self.flights [flight_key] = Flight ()
+				leader = True
+
+		if not leader:
+			return flight.wait ()
+
+		try:
+			value = self.getter (target)
+
+		except BaseException as error:
+
+			with self.lock:
+				del self.flights [flight_key]
+
+			flight.fail (error)
+
+			raise
+
+		with self.lock:
+
+			setattr (
+				target,
+				self.name,
+				value)
+
+			del self.flights [flight_key]
+
+		flight.finish (value)
+
+		return value
+
+class Flight (object):
+
+	def __init__ (self):
+
+		self.event = threading.Event ()
+
+		self.value = None
+		self.error = None
+
+		self.invalidated = False
+
+	def finish (self, value):
+
+		self.value = value
+		self.event.set ()
+
+	def fail (self, error):
+
+		self.error = error
+		self.event.set ()
+
+	def wait (self):
+
+		self.event.wait ()
+
+		if self.error is not None:
+			raise self.error
+
+		return self.value
+
+# caches the results of init_function by key. with no options it keeps
+# everything, as it always has. max_size and max_bytes bound the cache,
+# evicting the least recently used entries first, with each entry's bytes
+# given by size_function. entries older than ttl seconds are computed again
+# the next time they are asked for, and are dropped whenever a new entry is
+# stored
+
 class LazyDictionary:
 
-	def __init__ (self, init_function):
+	def __init__ (
+			self,
+			init_function,
+			max_size = None,
+			max_bytes = None,
+			size_function = None,
+			ttl = None,
+			clock = time.time):
 
 		self.init_function = init_function
 
-		self.dict = dict ()
+		self.max_size = max_size
+		self.max_bytes = max_bytes
+		self.size_function = size_function or sys.getsizeof
+		self.ttl = ttl
+		self.clock = clock
+
+		self.ordered = max_size is not None or max_bytes is not None
+		self.unbounded = not self.ordered and ttl is None
+
+		if self.ordered:
+			self.dict = collections.OrderedDict ()
+		else:
+			self.dict = dict ()
+
+		self.sizes = dict ()
+		self.total_bytes = 0
+
+		self.expires = dict ()
+		self.expiry_queue = collections.deque ()
+
+		self.reset_counters ()
+
+	def reset_counters (self):
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
 
 	def __getitem__ (self, key):
 
-		if key in self.dict:
+		if self.unbounded and key in self.dict:
+
+			self.hits += 1
+
 			return self.dict [key]
 
-		else:
-			value = self.init_function (key)
+		value = self.lookup (key)
+
+		if value is not missing:
+			return value
+
+		self.misses += 1
+
+		value = self.init_function (key)
+
+		self.store (key, value)
+
+		return value
+
+	def lookup (self, key):
+
+		if key not in self.dict:
+			return missing
+
+		if self.ttl is not None \
+		and self.expires [key] <= self.clock ():
+
+			self.evict (key)
+
+			return missing
+
+		self.hits += 1
+
+		if self.ordered:
+
+			value = self.dict.pop (key)
 			self.dict [key] = value
+
 			return value
 
+		return self.dict [key]
+
+	def __contains__ (self, key):
+
+		return key in self.dict
+
+	def __len__ (self):
+
+		return len (self.dict)
+
+	def store (self, key, value):
+
+		self.dict [key] = value
+
+		if self.ttl is not None:
+
+			expires = self.clock () + self.ttl
+
+			self.expires [key] = expires
+			self.expiry_queue.append ((expires, key))
+
+			self.purge_expired ()
+
+		if self.max_bytes is not None:
+
+			size = self.size_function (value)
+
+			self.sizes [key] = size
+			self.total_bytes += size
+
+		while self.dict and (
+			(self.max_size is not None
+				and len (self.dict) > self.max_size)
+			or (self.max_bytes is not None
+				and self.total_bytes > self.max_bytes)
+		):
+
+			self.evict (next (iter (self.dict)))
+
+	def purge_expired (self):
+
+		# the queue can hold stale times for keys stored again since, so
+		# only remove keys whose current expiry time matches
+
+		now = self.clock ()
+
+		while self.expiry_queue \
+		and self.expiry_queue [0] [0] <= now:
+
+			expires, key = self.expiry_queue.popleft ()
+
+			if self.expires.get (key) == expires:
+				self.evict (key)
+
+	def evict (self, key):
+
+		self.discard (key)
+
+		self.evictions += 1
+
+	def discard (self, key):
+
+		del self.dict [key]
+
+		self.expires.pop (key, None)
+
+		if key in self.sizes:
+			self.total_bytes -= self.sizes.pop (key)
+
+	def invalidate (self, key):
+
+		if key in self.dict:
+			self.discard (key)
+
+	def clear (self):
+
+		self.dict.clear ()
+		self.sizes.clear ()
+		self.expires.clear ()
+		self.expiry_queue.clear ()
+
+		self.total_bytes = 0
+
+# a LazyDictionary which can be shared between threads. init_function runs
+# outside the lock, once per key however many threads ask for it, so slow
+# keys don't hold up others. exceptions reach every waiting thread and are
+# not cached. invalidating a key while its value is being worked out stops
+# that value being stored, and the next lookup starts again
+
+class ThreadSafeLazyDictionary (LazyDictionary):
+
+	def __init__ (self, init_function, ** options):
+
+		LazyDictionary.__init__ (self, init_function, ** options)
+
+		self.lock = threading.RLock ()
+		self.flights = dict ()
+
+	def __getitem__ (self, key):
+
+		with self.lock:
+
+			value = self.lookup (key)
+
+			if value is not missing:
+				return value
+
+			flight = self.flights.get (key)
+
+			if flight is not None:
+				leader = False
+
+			else:
+
+				flight = self.flights [key] = Flight ()
+				leader = True
+
+				self.misses += 1
+
+		if not leader:
+			return flight.wait ()
+
+		try:
+			value = self.init_function (key)
+
+		except BaseException as error:
+
+			with self.lock:
+				self.end_flight (key, flight)
+
+			flight.fail (error)
+
+			raise
+
+		with self.lock:
+
+			if not flight.invalidated:
+				self.store (key, value)
+
+			self.end_flight (key, flight)
+
+		flight.finish (value)
+
+		return value
+
+	def __contains__ (self, key):
+
+		with self.lock:
+			return LazyDictionary.__contains__ (self, key)
+
+	def __len__ (self):
+
+		with self.lock:
+			return LazyDictionary.__len__ (self)
+
+	def end_flight (self, key, flight):
+
+		if self.flights.get (key) is flight:
+			del self.flights [key]
+
+	def invalidate (self, key):
+
+		with self.lock:
+
+			LazyDictionary.invalidate (self, key)
+
+			flight = self.flights.pop (key, None)
+
+			if flight is not None:
+				flight.invalidated = True
+
+	def clear (self):
+
+		with self.lock:
+
+			LazyDictionary.clear (self)
+
+			for flight in self.flights.values ():
+				flight.invalidated = True
+
+			self.flights.clear ()
+
 # ex: noet ts=4 filetype=python
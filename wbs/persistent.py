@@ -0,0 +1,770 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+
+from wbs.data import DIGEST_MODULUS
+from wbs.data import content_digest
+from wbs.data import item_digest
+from wbs.data import mapping_digest
+from wbs.data import order_digest
+from wbs.data import pair_digest
+from wbs.data import sequence_digest
+
+__all__ = [
+	"PersistentOrderedMap",
+	"PersistentVector",
+	"to_persistent",
+	"from_persistent",
+]
+
+# persistent (immutable, structurally shared) containers. every update
+# returns a new container which shares all untouched nodes with the old one,
+# so both versions stay valid and an update only costs O(log n).
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+HASH_MASK = 0xffffffff
+
+missing = object ()
+deleted = object ()
+
+# vector: a 32 way trie of tuples, with the items in the leaves
+
+class PersistentVector (collections.Sequence):
+
+	def __init__ (
+			self,
+			count = 0,
+			shift = 0,
+			root = (),
+			digest_total = None):
+
+		self.count = count
+		self.shift = shift
+		self.root = root
+
+		self.digest_total = digest_total
+		self.order_total = None
+
+	@classmethod
+	def from_items (cls, items):
+
+		nodes = tuple (items)
+		count = len (nodes)
+		shift = 0
+
+		nodes = [
+			nodes [start : start + WIDTH]
+			for start in xrange (0, count, WIDTH)
+		]
+
+		while len (nodes) > 1:
+
+			nodes = [
+				tuple (nodes [start : start + WIDTH])
+				for start in xrange (0, len (nodes), WIDTH)
+			]
+
+			shift += BITS
+
+		return cls (
+			count,
+			shift,
+			nodes [0] if nodes else ())
+
+	def __len__ (self):
+
+		return self.count
+
+	def __getitem__ (self, index):
+
+		if isinstance (index, slice):
+
+			return [
+				self [item_index]
+				for item_index in xrange (* index.indices (self.count))
+			]
+
+		if index < 0:
+			index += self.count
+
+		if not 0 <= index < self.count:
+			raise IndexError (index)
+
+		node = self.root
+		shift = self.shift
+
+		while shift > 0:
+
+			node = node [(index >> shift) & MASK]
+			shift -= BITS
+
+		return node [index & MASK]
+
+	def __iter__ (self):
+
+		for leaf in iter_leaves (self.root, self.shift):
+
+			for item in leaf:
+				yield item
+
+	def __repr__ (self):
+
+		return "PersistentVector (%r)" % list (self)
+
+	def set (self, index, value):
+
+		if index < 0:
+			index += self.count
+
+		if not 0 <= index < self.count:
+			raise IndexError (index)
+
+		digest_total = self.digest_total
+
+		if digest_total is not None:
+
+			digest_total = (
+				digest_total
+				- item_digest (index, content_digest (self [index]))
+				+ item_digest (index, content_digest (value))
+			) % DIGEST_MODULUS
+
+		return PersistentVector (
+			self.count,
+			self.shift,
+			vector_set (self.root, self.shift, index, value),
+			digest_total)
+
+	def append (self, value):
+
+		digest_total = self.digest_total
+
+		if digest_total is not None:
+
+			digest_total = (
+				digest_total
+				+ item_digest (self.count, content_digest (value))
+			) % DIGEST_MODULUS
+
+		if self.count == WIDTH << self.shift:
+
+			return PersistentVector (
+				self.count + 1,
+				self.shift + BITS,
+				(self.root, vector_path (self.shift, value)),
+				digest_total)
+
+		return PersistentVector (
+			self.count + 1,
+			self.shift,
+			vector_push (self.root, self.shift, self.count, value),
+			digest_total)
+
+	def extend (self, items):
+
+		vector = self
+
+		for item in items:
+			vector = vector.append (item)
+
+		return vector
+
+	def evolve (self, path, value):
+
+		return evolve (self, path, value)
+
+	def content_digest (self):
+
+		if self.digest_total is None:
+
+			self.digest_total = sum ([
+				item_digest (index, content_digest (item))
+				for index, item in enumerate (self)
+			]) % DIGEST_MODULUS
+
+		return sequence_digest (
+			self.digest_total,
+			self.count)
+
+	def order_digest (self):
+
+		if self.order_total is None:
+			self.order_total = order_digest (self)
+
+		return self.order_total
+
+def iter_leaves (node, shift):
+
+	if shift == 0:
+
+		yield node
+
+		return
+
+	for child in node:
+
+		for leaf in iter_leaves (child, shift - BITS):
+			yield leaf
+
+def vector_set (node, shift, index, value):
+
+	position = (index >> shift) & MASK
+
+	if shift == 0:
+		child = value
+
+	else:
+		child = vector_set (node [position], shift - BITS, index, value)
+
+	return node [: position] + (child,) + node [position + 1 :]
+
+def vector_push (node, shift, index, value):
+
+	if shift == 0:
+		return node + (value,)
+
+	position = (index >> shift) & MASK
+
+	if position < len (node):
+
+		return node [: position] + (
+			vector_push (node [position], shift - BITS, index, value),
+		)
+
+	return node + (vector_path (shift - BITS, value),)
+
+def vector_path (shift, value):
+
+	node = (value,)
+
+	while shift > 0:
+
+		node = (node,)
+		shift -= BITS
+
+	return node
+
+# hash array mapped trie. bitmap nodes hold a tuple of entries, each either a
+# (hash, key, value) leaf or a child node. keys whose 32 bit hashes are equal
+# share a collision node.
+
+class HamtNode (object):
+
+	__slots__ = [
+		"bitmap",
+		"entries",
+	]
+
+	def __init__ (self, bitmap, entries):
+
+		self.bitmap = bitmap
+		self.entries = entries
+
+class HamtCollisionNode (object):
+
+	__slots__ = [
+		"key_hash",
+		"entries",
+	]
+
+	def __init__ (self, key_hash, entries):
+
+		self.key_hash = key_hash
+		self.entries = entries
+
+empty_hamt = HamtNode (0, ())
+
+def key_hash (key):
+
+	return hash (key) & HASH_MASK
+
+def bit_index (bitmap, bit):
+
+	return bin (bitmap & (bit - 1)).count ("1")
+
+def hamt_get (node, hash_value, key):
+
+	shift = 0
+
+	while True:
+
+		if isinstance (node, HamtCollisionNode):
+
+			for entry_key, entry_value in node.entries:
+
+				if entry_key == key:
+					return entry_value
+
+			return missing
+
+		bit = 1 << ((hash_value >> shift) & MASK)
+
+		if not node.bitmap & bit:
+			return missing
+
+		entry = node.entries [bit_index (node.bitmap, bit)]
+
+		if isinstance (entry, tuple):
+
+			if entry [0] == hash_value and entry [1] == key:
+				return entry [2]
+
+			return missing
+
+		node = entry
+		shift += BITS
+
+def hamt_set (node, hash_value, key, value, shift):
+
+	if isinstance (node, HamtCollisionNode):
+
+		if node.key_hash == hash_value:
+
+			entries = [
+				(entry_key, entry_value)
+				for entry_key, entry_value in node.entries
+				if entry_key != key
+			]
+
+			added = len (entries) == len (node.entries)
+
+			entries.append ((key, value))
+
+			return HamtCollisionNode (hash_value, tuple (entries)), added
+
+		node = HamtNode (
+			1 << ((node.key_hash >> shift) & MASK),
+			(node,))
+
+	bit = 1 << ((hash_value >> shift) & MASK)
+	index = bit_index (node.bitmap, bit)
+	entries = node.entries
+
+	if not node.bitmap & bit:
+
+		return HamtNode (
+			node.bitmap | bit,
+			entries [: index] + ((hash_value, key, value),) + entries [index :],
+		), True
+
+	entry = entries [index]
+
+	if isinstance (entry, tuple):
+
+		if entry [0] == hash_value and entry [1] == key:
+
+			new_entry = (hash_value, key, value)
+			added = False
+
+		else:
+
+			new_entry = hamt_merge (
+				entry,
+				(hash_value, key, value),
+				shift + BITS)
+
+			added = True
+
+	else:
+
+		new_entry, added = hamt_set (
+			entry,
+			hash_value,
+			key,
+			value,
+			shift + BITS)
+
+	return HamtNode (
+		node.bitmap,
+		entries [: index] + (new_entry,) + entries [index + 1 :],
+	), added
+
+def hamt_merge (first, second, shift):
+
+	if first [0] == second [0]:
+
+		return HamtCollisionNode (
+			first [0],
+			((first [1], first [2]), (second [1], second [2])))
+
+	first_bit = 1 << ((first [0] >> shift) & MASK)
+	second_bit = 1 << ((second [0] >> shift) & MASK)
+
+	if first_bit == second_bit:
+
+		return HamtNode (
+			first_bit,
+			(hamt_merge (first, second, shift + BITS),))
+
+	if first_bit < second_bit:
+		entries = (first, second)
+
+	else:
+		entries = (second, first)
+
+	return HamtNode (
+		first_bit | second_bit,
+		entries)
+
+def hamt_build (leaves, shift):
+
+	# builds a node from distinct (hash, key, value) leaves in one go
+
+	buckets = {}
+
+	for leaf in leaves:
+
+		buckets.setdefault (
+			(leaf [0] >> shift) & MASK,
+			[]).append (leaf)
+
+	bitmap = 0
+	entries = []
+
+	for bucket_index in sorted (buckets):
+
+		bucket = buckets [bucket_index]
+
+		bitmap |= 1 << bucket_index
+
+		if len (bucket) == 1:
+
+			entries.append (bucket [0])
+
+		elif all (leaf [0] == bucket [0] [0] for leaf in bucket):
+
+			entries.append (
+				HamtCollisionNode (
+					bucket [0] [0],
+					tuple ([
+						(leaf [1], leaf [2])
+						for leaf in bucket
+					])))
+
+		else:
+
+			entries.append (
+				hamt_build (bucket, shift + BITS))
+
+	return HamtNode (bitmap, tuple (entries))
+
+def hamt_delete (node, hash_value, key, shift):
+
+	# returns the new node, or None when it is now empty, or the same node
+	# when the key was not present
+
+	if isinstance (node, HamtCollisionNode):
+
+		entries = tuple ([
+			(entry_key, entry_value)
+			for entry_key, entry_value in node.entries
+			if entry_key != key
+		])
+
+		if len (entries) == len (node.entries):
+			return node
+
+		if len (entries) == 1:
+
+			return HamtNode (
+				1 << ((hash_value >> shift) & MASK),
+				((hash_value, entries [0] [0], entries [0] [1]),))
+
+		return HamtCollisionNode (hash_value, entries)
+
+	bit = 1 << ((hash_value >> shift) & MASK)
+
+	if not node.bitmap & bit:
+		return node
+
+	index = bit_index (node.bitmap, bit)
+	entry = node.entries [index]
+
+	if isinstance (entry, tuple):
+
+		if entry [0] != hash_value or entry [1] != key:
+			return node
+
+		new_entry = None
+
+	else:
+
+		new_entry = hamt_delete (entry, hash_value, key, shift + BITS)
+
+		if new_entry is entry:
+			return node
+
+		# pull single leaves up into this node
+
+		if isinstance (new_entry, HamtNode) \
+		and len (new_entry.entries) == 1 \
+		and isinstance (new_entry.entries [0], tuple):
+			new_entry = new_entry.entries [0]
+
+	if new_entry is None:
+
+		if node.bitmap == bit:
+			return None
+
+		return HamtNode (
+			node.bitmap & ~ bit,
+			node.entries [: index] + node.entries [index + 1 :])
+
+	return HamtNode (
+		node.bitmap,
+		node.entries [: index] + (new_entry,) + node.entries [index + 1 :])
+
+# ordered map: a hamt from key to (position, value), plus a vector of keys in
+# insertion order. deleted keys leave a marker in the vector, which is
+# compacted once markers outnumber the live keys.
+
+class PersistentOrderedMap (collections.Mapping):
+
+	def __init__ (
+			self,
+			index = empty_hamt,
+			order = None,
+			count = 0,
+			digest_total = None):
+
+		self.index = index
+		self.order = order if order is not None else PersistentVector ()
+		self.count = count
+
+		self.digest_total = digest_total
+		self.order_total = None
+
+	@classmethod
+	def from_items (cls, items):
+
+		positions = {}
+		keys = []
+		values = []
+
+		for key, value in items:
+
+			if key in positions:
+				values [positions [key]] = value
+				continue
+
+			positions [key] = len (keys)
+
+			keys.append (key)
+			values.append (value)
+
+		if not keys:
+			return cls ()
+
+		return cls (
+			hamt_build ([
+				(key_hash (key), key, (position, value))
+				for position, (key, value) in enumerate (zip (keys, values))
+			], 0),
+			PersistentVector.from_items (keys),
+			len (keys))
+
+	def __len__ (self):
+
+		return self.count
+
+	def __getitem__ (self, key):
+
+		entry = hamt_get (self.index, key_hash (key), key)
+
+		if entry is missing:
+			raise KeyError (key)
+
+		return entry [1]
+
+	def __contains__ (self, key):
+
+		return hamt_get (self.index, key_hash (key), key) is not missing
+
+	def __iter__ (self):
+
+		for key in self.order:
+
+			if key is not deleted:
+				yield key
+
+	def __repr__ (self):
+
+		return "PersistentOrderedMap (%r)" % self.items ()
+
+	def set (self, key, value):
+
+		hash_value = key_hash (key)
+		entry = hamt_get (self.index, hash_value, key)
+
+		if entry is missing:
+
+			position = len (self.order)
+			order = self.order.append (key)
+			count = self.count + 1
+
+		else:
+
+			if entry [1] is value:
+				return self
+
+			position = entry [0]
+			order = self.order
+			count = self.count
+
+		index, added = hamt_set (
+			self.index,
+			hash_value,
+			key,
+			(position, value),
+			0)
+
+		digest_total = self.digest_total
+
+		if digest_total is not None:
+
+			key_digest = content_digest (key)
+
+			digest_total += pair_digest (key_digest, content_digest (value))
+
+			if entry is not missing:
+
+				digest_total -= pair_digest (
+					key_digest,
+					content_digest (entry [1]))
+
+			digest_total %= DIGEST_MODULUS
+
+		return PersistentOrderedMap (index, order, count, digest_total)
+
+	def delete (self, key):
+
+		hash_value = key_hash (key)
+		entry = hamt_get (self.index, hash_value, key)
+
+		if entry is missing:
+			raise KeyError (key)
+
+		index = hamt_delete (self.index, hash_value, key, 0)
+
+		if index is None:
+			return PersistentOrderedMap ()
+
+		order = self.order.set (entry [0], deleted)
+		count = self.count - 1
+
+		digest_total = self.digest_total
+
+		if digest_total is not None:
+
+			digest_total = (
+				digest_total
+				- pair_digest (content_digest (key), content_digest (entry [1]))
+			) % DIGEST_MODULUS
+
+		if len (order) > WIDTH and count * 2 < len (order):
+
+			result = PersistentOrderedMap.from_items ([
+				(item_key, hamt_get (index, key_hash (item_key), item_key) [1])
+				for item_key in order
+				if item_key is not deleted
+			])
+
+			result.digest_total = digest_total
+
+			return result
+
+		return PersistentOrderedMap (index, order, count, digest_total)
+
+	def evolve (self, path, value):
+
+		return evolve (self, path, value)
+
+	def content_digest (self):
+
+		if self.digest_total is None:
+
+			self.digest_total = sum ([
+				pair_digest (content_digest (key), content_digest (item))
+				for key, item in self.items ()
+			]) % DIGEST_MODULUS
+
+		return mapping_digest (
+			self.digest_total,
+			self.count)
+
+	def order_digest (self):
+
+		if self.order_total is None:
+			self.order_total = order_digest (self)
+
+		return self.order_total
+
+def evolve (container, path, value):
+
+	path = tuple (path)
+
+	if not path:
+		return value
+
+	key = path [0]
+
+	if len (path) == 1:
+		return container.set (key, value)
+
+	child = container [key]
+
+	if not isinstance (child, (PersistentOrderedMap, PersistentVector)):
+
+		raise Exception (
+			"Can't evolve into %s" % type (child))
+
+	return container.set (
+		key,
+		child.evolve (path [1 :], value))
+
+def to_persistent (value):
+
+	if isinstance (value, (PersistentOrderedMap, PersistentVector)):
+		return value
+
+	if isinstance (value, dict):
+
+		return PersistentOrderedMap.from_items ([
+			(key, to_persistent (item))
+			for key, item in value.items ()
+		])
+
+	if isinstance (value, (list, tuple)):
+
+		return PersistentVector.from_items ([
+			to_persistent (item)
+			for item in value
+		])
+
+	return value
+
+def from_persistent (value):
+
+	if isinstance (value, PersistentOrderedMap):
+
+		return collections.OrderedDict ([
+			(key, from_persistent (item))
+			for key, item in value.items ()
+		])
+
+	if isinstance (value, PersistentVector):
+
+		return [
+			from_persistent (item)
+			for item in value
+		]
+
+	return value
+
+# ex: noet ts=4 filetype=python
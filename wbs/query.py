@@ -0,0 +1,386 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import bisect
+import collections
+
+__all__ = [
+	"DataIndex",
+	"DataQuery",
+]
+
+missing = object ()
+
+string_types = (str, unicode)
+
+mapping_types = set ([ dict, collections.OrderedDict ])
+
+# each indexed value maps to the set of record keys holding it. lookups sort
+# the keys and keep the result until the value's keys change. string values
+# are also kept sorted for prefix lookups, but only when a prefix lookup is
+# made, so adding many records costs one sort instead of one insert each
+
+class DataIndex (object):
+
+	def __init__ (self, field_path):
+
+		self.field_path = parse_field_path (field_path)
+
+		self.entries = {}
+		self.found = {}
+
+		self.sorted_values = []
+		self.new_values = set ()
+		self.values_removed = False
+
+	def index_values (self, record):
+
+		value = field_value (record, self.field_path)
+
+		if value is missing:
+			return []
+
+		if isinstance (value, list):
+
+			return [
+				item
+				for item in value
+				if is_hashable (item)
+			]
+
+		if is_hashable (value):
+			return [ value ]
+
+		return []
+
+	def add (self, key, record):
+
+		for value in self.index_values (record):
+
+			keys = self.entries.get (value)
+
+			if keys is None:
+
+				keys = self.entries [value] = set ()
+
+				if isinstance (value, string_types):
+					self.new_values.add (value)
+
+			keys.add (key)
+
+			self.found.pop (value, None)
+
+	def remove (self, key, record):
+
+		for value in self.index_values (record):
+
+			keys = self.entries.get (value)
+
+			if keys is None:
+				continue
+
+			keys.discard (key)
+
+			self.found.pop (value, None)
+
+			if keys:
+				continue
+
+			del self.entries [value]
+
+			if isinstance (value, string_types):
+
+				self.new_values.discard (value)
+				self.values_removed = True
+
+	def find (self, value):
+
+		if not is_hashable (value):
+			return []
+
+		return list (self.found_keys (value))
+
+	def found_keys (self, value):
+
+		found = self.found.get (value)
+
+		if found is not None:
+			return found
+
+		keys = self.entries.get (value)
+
+		if not keys:
+			return ()
+
+		found = self.found [value] = sorted (keys)
+
+		return found
+
+	def update_sorted_values (self):
+
+		if not self.new_values and not self.values_removed:
+			return
+
+		entries = self.entries
+
+		sorted_values = self.sorted_values
+
+		if self.values_removed:
+
+			# a value removed and added again is still in the sorted list
+
+			sorted_values = [
+				value
+				for value in sorted_values
+				if value in entries
+				and value not in self.new_values
+			]
+
+		# the list is already sorted, so this sorts just the new values and
+		# merges them in
+
+		sorted_values.extend (self.new_values)
+		sorted_values.sort ()
+
+		self.sorted_values = sorted_values
+		self.new_values = set ()
+		self.values_removed = False
+
+	def find_prefix (self, prefix):
+
+		self.update_sorted_values ()
+
+		keys = []
+
+		sorted_values = self.sorted_values
+
+		position = bisect.bisect_left (sorted_values, prefix)
+
+		while position < len (sorted_values):
+
+			value = sorted_values [position]
+
+			if not value.startswith (prefix):
+				break
+
+			keys.extend (self.found_keys (value))
+
+			position += 1
+
+		return keys
+
+class DataQuery (object):
+
+	def __init__ (self, tree = None, depth = 1):
+
+		self.depth = depth
+
+		self.records = collections.OrderedDict ()
+		self.indexes = {}
+
+		# the names found under each partial key, so a subtree's records can
+		# be found without looking at every key
+
+		self.children = {}
+
+		if tree is not None:
+
+			for key, record in iter_records (tree, depth):
+
+				self.records [key] = record
+
+				self.add_key (key)
+
+	def index (self, field_path):
+
+		field_path = parse_field_path (field_path)
+
+		if field_path in self.indexes:
+			return self.indexes [field_path]
+
+		index = self.indexes [field_path] = (
+			DataIndex (field_path))
+
+		# the index doesn't keep the records' order, so this skips the much
+		# slower iteration of the ordered dictionary
+
+		for key, record in dict.iteritems (self.records):
+			index.add (key, record)
+
+		return index
+
+	def find_keys (self, field_path, value):
+
+		return self.index (field_path).find (value)
+
+	def find (self, field_path, value):
+
+		return [
+			self.records [key]
+			for key in self.find_keys (field_path, value)
+		]
+
+	def find_prefix_keys (self, field_path, prefix):
+
+		return self.index (field_path).find_prefix (prefix)
+
+	def find_prefix (self, field_path, prefix):
+
+		return [
+			self.records [key]
+			for key in self.find_prefix_keys (field_path, prefix)
+		]
+
+	def __getitem__ (self, key):
+
+		return self.records [key]
+
+	def __len__ (self):
+
+		return len (self.records)
+
+	def replace (self, key, record):
+
+		self.remove (key)
+
+		self.records [key] = record
+
+		self.add_key (key)
+
+		for index in self.indexes.values ():
+			index.add (key, record)
+
+	def remove (self, key):
+
+		if key not in self.records:
+			return
+
+		record = self.records.pop (key)
+
+		self.remove_key (key)
+
+		for index in self.indexes.values ():
+			index.remove (key, record)
+
+	def add_key (self, key):
+
+		for length in xrange (len (key)):
+
+			names = self.children.get (key [: length])
+
+			if names is None:
+				names = self.children [key [: length]] = set ()
+
+			names.add (key [length])
+
+	def remove_key (self, key):
+
+		for length in xrange (len (key) - 1, -1, -1):
+
+			names = self.children [key [: length]]
+
+			names.discard (key [length])
+
+			if names:
+				break
+
+			del self.children [key [: length]]
+
+	def subtree_keys (self, prefix):
+
+		if len (prefix) == self.depth:
+
+			if prefix in self.records:
+				return [ prefix ]
+
+			return []
+
+		return [
+			key
+			for name in self.children.get (prefix, ())
+			for key in self.subtree_keys (prefix + (name,))
+		]
+
+	def replace_subtree (self, prefix, subtree):
+
+		prefix = tuple (prefix)
+
+		if len (prefix) > self.depth:
+
+			raise Exception (
+				"Subtree path is deeper than the records")
+
+		for key in self.subtree_keys (prefix):
+			self.remove (key)
+
+		if subtree is None:
+			return
+
+		if len (prefix) == self.depth:
+
+			self.replace (prefix, subtree)
+
+			return
+
+		for key, record in iter_records (
+				subtree,
+				self.depth - len (prefix)):
+
+			self.replace (prefix + key, record)
+
+def iter_records (tree, depth, names = ()):
+
+	if depth == 0:
+
+		yield names, tree
+
+		return
+
+	if not isinstance (tree, collections.Mapping):
+		return
+
+	for child_name, child_tree in tree.items ():
+
+		for entry in iter_records (
+				child_tree,
+				depth - 1,
+				names + (child_name,)):
+
+			yield entry
+
+def parse_field_path (field_path):
+
+	if isinstance (field_path, string_types):
+		return tuple (field_path.split ("."))
+
+	return tuple (field_path)
+
+def field_value (record, field_path):
+
+	value = record
+
+	for name in field_path:
+
+		if not (
+			value.__class__ in mapping_types
+			or isinstance (value, collections.Mapping)
+		) or name not in value:
+			return missing
+
+		value = value [name]
+
+	return value
+
+def is_hashable (value):
+
+	try:
+		hash (value)
+
+	except TypeError:
+		return False
+
+	return True
+
+# ex: noet ts=4 filetype=python
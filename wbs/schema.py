@@ -3,14 +3,94 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
+import keyword
+import re
+
+from wbs.data import deep_copy
+from wbs.query import is_hashable
+from wbs.query import iter_records
+
+__all__ = [
+	"schemas",
+	"Schema",
+	"SchemaReference",
+	"SchemaField",
+	"SchemaGroup",
+	"SchemaDatabase",
+	"SchemaValidator",
+	"SchemaViolation",
+	"SchemaRecord",
+	"read_groups",
+	"read_group",
+	"read_field",
+	"record_class_for",
+	"records_from_dicts",
+	"records_to_dicts",
+]
+
 schemas = dict ()
 
+SchemaViolation = collections.namedtuple (
+	"SchemaViolation",
+	[ "path", "message" ])
+
 class Schema:
 
 	def __init__ (self, groups):
 
 		self.groups = groups
 
+		self.fields = [
+			field
+			for group in groups
+			for field in group.fields
+		]
+
+		self.fields_by_name = dict ([
+			(field.name, field)
+			for field in self.fields
+		])
+
+	def field (self, name):
+
+		return self.fields_by_name.get (name)
+
+# stands in for a schema referred to by name from a sub_schema, and looks it
+# up in the database the first time it is used, so schemas can refer to ones
+# which are read later, or to themselves. the database holds generated record
+# classes, which can't be pickled, so a pickled reference carries the schema
+# it resolves to instead
+
+class SchemaReference (Schema):
+
+	def __init__ (self, database, name):
+
+		self.database = database
+		self.name = name
+
+	def resolve (self):
+
+		if self.database is None:
+			return self.schema
+
+		return self.database [self.name]
+
+	def __getstate__ (self):
+
+		return {
+			"database": None,
+			"name": self.name,
+			"schema": self.resolve (),
+		}
+
+	def __getattr__ (self, name):
+
+		if name.startswith ("__"):
+			raise AttributeError (name)
+
+		return getattr (self.resolve (), name)
+
 class SchemaField:
 
 	def __init__ (
@@ -39,22 +119,97 @@ class SchemaGroup:
 
 		self.fields = fields
 
+# copies a schema so that its references, including those in inline sub
+# schemas, look names up in the given database
+
+def bind_schema (database, schema):
+
+	return Schema ([
+		SchemaGroup ([
+			bind_field (database, field)
+			for field in group.fields
+		])
+		for group in schema.groups
+	])
+
+def bind_field (database, field):
+
+	sub_schema = field.sub_schema
+
+	if isinstance (sub_schema, SchemaReference):
+		sub_schema = SchemaReference (database, sub_schema.name)
+
+	elif isinstance (sub_schema, Schema):
+		sub_schema = bind_schema (database, sub_schema)
+
+	return SchemaField (
+		name = field.name,
+		type = field.type,
+		required = field.required,
+		default = field.default,
+		sub_schema = sub_schema,
+		values = field.values,
+		help = field.help)
+
+# a database created with a parent holds only its own definitions, and
+# looks up everything else in the parent. sub schemas referred to by name are
+# looked up in the layer they are used through, so a schema from the parent
+# sees definitions made above it. to make that hold for every consumer, the
+# validators, record classes and the yamlx encoder alike, a parent's schema
+# is handed out as a copy whose references point at this database. the
+# copies, compiled validators and record classes are dropped whenever this
+# database or any below it defines a schema, since they may refer to the old
+# definition
+
 class SchemaDatabase:
 
-	def __init__ (self, source = None):
+	def __init__ (self, source = None, parent = None):
 
 		if source:
 
-			self.schemas = source.schemas.copy ()
+			self.schemas = dict ([
+				(name, bind_schema (self, schema))
+				for name, schema in source.schemas.items ()
+			])
 
 		else:
 
 			self.schemas = dict ()
 
+		self.parent = parent
+		self.version = 0
+
+		self.cached_versions = None
+		self.validators = dict ()
+		self.record_classes = dict ()
+		self.bound_schemas = dict ()
+
 	def define (self, name, groups):
 
 		self.schemas [name] = Schema (groups)
 
+		self.version += 1
+
+	def versions (self):
+
+		if self.parent is None:
+			return (self.version,)
+
+		return (self.version,) + self.parent.versions ()
+
+	def check_caches (self):
+
+		versions = self.versions ()
+
+		if versions == self.cached_versions:
+			return
+
+		self.validators.clear ()
+		self.record_classes.clear ()
+		self.bound_schemas.clear ()
+
+		self.cached_versions = versions
+
 	def read_all (self, all_data):
 
 		for schema_name, schema_data in all_data.items ():
@@ -62,29 +217,554 @@ class SchemaDatabase:
 
 	def read (self, schema_name, schema_data):
 
-		self.define (schema_name, [
-			read_group (group_name, group_data)
-			for group_name, group_data in schema_data.items ()
-		])
+		self.define (schema_name, read_groups (schema_data, self))
 
 	def __getitem__ (self, name):
 
-		return self.schemas [name]
+		if name in self.schemas:
+			return self.schemas [name]
+
+		if self.parent is None:
+			raise KeyError (name)
+
+		self.check_caches ()
+
+		if name in self.bound_schemas:
+			return self.bound_schemas [name]
+
+		schema = self.bound_schemas [name] = (
+			bind_schema (self, self.parent [name]))
+
+		return schema
+
+	def __contains__ (self, name):
+
+		try:
+			self [name]
+
+		except KeyError:
+			return False
+
+		return True
+
+	def get (self, name, default = None):
+
+		try:
+			return self [name]
+
+		except KeyError:
+			return default
+
+	def names (self):
+
+		names = set (self.schemas)
+
+		if self.parent is not None:
+			names.update (self.parent.names ())
+
+		return names
+
+	def compile (self, name):
+
+		self.check_caches ()
+
+		if name in self.validators:
+			return self.validators [name]
+
+		# the validator is cached before its fields are compiled, so that
+		# schemas which contain themselves resolve to the same validator
+
+		validator = self.validators [name] = SchemaValidator ()
+
+		try:
+			validator.compile (self, self [name])
+
+		except:
+
+			del self.validators [name]
+
+			raise
+
+		return validator
+
+	def record_class (self, name):
+
+		self.check_caches ()
+
+		if name in self.record_classes:
+			return self.record_classes [name]
+
+		# cached before the fields are resolved, as with compile
+
+		record_class = self.record_classes [name] = (
+			create_record_class (name, self [name]))
+
+		try:
+			resolve_record_fields (self, record_class, self [name])
+
+		except:
+
+			del self.record_classes [name]
+
+			raise
+
+		return record_class
+
+# checks data against a schema. everything which can be worked out from the
+# schema alone, the required field names and the check for each field, is
+# done once in compile, so validate only does dictionary lookups per field.
+# validate and validate_tree return every violation found, as a list of
+# SchemaViolation tuples
+
+class SchemaValidator (object):
+
+	def __init__ (self):
+
+		self.required_names = []
+		self.field_checks = dict ()
+
+	def compile (self, database, schema):
+
+		for field in schema.fields:
+
+			if field.required:
+				self.required_names.append (field.name)
+
+			self.field_checks [field.name] = (
+				type_checks.get (field.type),
+				field.type,
+				frozenset (field.values)
+					if field.values is not None
+					else None,
+				compile_sub_schema (database, field.sub_schema))
+
+	def validate (self, data, path = ()):
+
+		violations = []
+
+		self.check_record (data, tuple (path), violations)
+
+		return violations
+
+	def validate_tree (self, tree, depth = 1):
+
+		violations = []
+
+		for names, record in iter_records (tree, depth, ()):
+			self.check_record (record, names, violations)
+
+		return violations
+
+	def check_record (self, data, path, violations):
+
+		if not isinstance (data, collections.Mapping):
+
+			violations.append (
+				SchemaViolation (
+					path,
+					"Expected a mapping but got %s" % type (data).__name__))
+
+			return
+
+		for name in self.required_names:
+
+			if data.get (name) is None:
+
+				violations.append (
+					SchemaViolation (
+						path + (name,),
+						"Missing required field"))
+
+		field_checks = self.field_checks
+
+		for name, value in data.items ():
+
+			if value is None:
+				continue
+
+			field_check = field_checks.get (name)
+
+			if field_check is None:
+				continue
+
+			type_check, type_name, values, sub_validator = field_check
+
+			if type_check is not None \
+			and not type_check (value):
+
+				violations.append (
+					SchemaViolation (
+						path + (name,),
+						"Expected %s but got %s" % (
+							type_name,
+							type (value).__name__)))
+
+				continue
+
+			if values is not None \
+			and not (is_hashable (value) and value in values):
+
+				violations.append (
+					SchemaViolation (
+						path + (name,),
+						"Invalid value %r" % (value,)))
+
+			if sub_validator is None:
+				continue
+
+			if is_list (value):
+
+				for index, item in enumerate (value):
+
+					sub_validator.check_record (
+						item,
+						path + (name, index),
+						violations)
 
-def read_group (group_name, group_data):
+			else:
+
+				sub_validator.check_record (
+					value,
+					path + (name,),
+					violations)
+
+def compile_sub_schema (database, sub_schema):
+
+	if sub_schema is None:
+		return None
+
+	if isinstance (sub_schema, SchemaReference):
+		return database.compile (sub_schema.name)
+
+	if isinstance (sub_schema, Schema):
+
+		validator = SchemaValidator ()
+		validator.compile (database, sub_schema)
+
+		return validator
+
+	return database.compile (sub_schema)
+
+def is_string (value):
+
+	return isinstance (value, (str, unicode))
+
+def is_integer (value):
+
+	return isinstance (value, (int, long)) \
+		and not isinstance (value, bool)
+
+def is_number (value):
+
+	return isinstance (value, (int, long, float)) \
+		and not isinstance (value, bool)
+
+def is_boolean (value):
+
+	return isinstance (value, bool)
+
+def is_list (value):
+
+	return isinstance (value, collections.Sequence) \
+		and not isinstance (value, (str, unicode))
+
+def is_mapping (value):
+
+	return isinstance (value, collections.Mapping)
+
+# types not listed here are not checked
+
+type_checks = {
+	"string": is_string,
+	"str": is_string,
+	"int": is_integer,
+	"integer": is_integer,
+	"float": is_number,
+	"number": is_number,
+	"bool": is_boolean,
+	"boolean": is_boolean,
+	"list": is_list,
+	"dict": is_mapping,
+	"map": is_mapping,
+}
+
+def read_groups (schema_data, database = None):
+
+	return [
+		read_group (group_name, group_data, database)
+		for group_name, group_data in schema_data.items ()
+	]
+
+def read_group (group_name, group_data, database = None):
 
 	return SchemaGroup ([
-		read_field (field_name, field_data)
+		read_field (field_name, field_data, database)
 		for field_name, field_data in group_data.items ()
 	])
 
-def read_field (field_name, field_data):
+def read_field (field_name, field_data, database = None):
 
 	return SchemaField (
 		name = field_name,
-		required = field_data ["required"] == "yes",
+		required = field_data.get ("required") in ("yes", True),
 		type = field_data ["type"],
-		default = None,
-		sub_schema = None)
+		default = field_data.get ("default"),
+		sub_schema = read_sub_schema (
+			field_data.get ("sub_schema"),
+			database),
+		values = field_data.get ("values"),
+		help = field_data.get ("help"))
+
+def read_sub_schema (sub_schema_data, database):
+
+	# either the name of a schema, or a schema's groups written inline
+
+	if sub_schema_data is None:
+		return None
+
+	if isinstance (sub_schema_data, collections.Mapping):
+		return Schema (read_groups (sub_schema_data, database))
+
+	if database is None:
+		return sub_schema_data
+
+	return SchemaReference (database, sub_schema_data)
+
+# records generated from a schema hold one slot per field instead of a
+# dictionary. fields missing from the data get the field's default, keys the
+# schema doesn't know about are kept in _extra so that to_dict gives back
+# what was read. fields which were missing from the data are left out of
+# to_dict, unless they have been given a value other than the default since
+
+missing = object ()
+
+class SchemaRecord (object):
+
+	__slots__ = [ "_extra", "_defaulted" ]
+
+	record_fields = ()
+	record_field_names = frozenset ()
+
+	def __init__ (self, data = None):
+
+		if data is None:
+			data = {}
+
+		matched = 0
+		defaulted = []
+
+		for field_name, attribute, default, required, sub_class \
+		in self.record_fields:
+
+			value = data.get (field_name, missing)
+
+			if value is missing:
+
+				if required:
+
+					raise Exception (
+						"Missing required field %s in %s" % (
+							field_name,
+							type (self).__name__))
+
+				if isinstance (default, (dict, list)):
+					value = deep_copy (default)
+
+				else:
+					value = default
+
+				defaulted.append (field_name)
+
+			else:
+
+				matched += 1
+
+				if sub_class is not None:
+					value = convert_sub_record (sub_class, value)
+
+			setattr (self, attribute, value)
+
+		if matched < len (data):
+
+			self._extra = collections.OrderedDict ([
+				(extra_key, extra_value)
+				for extra_key, extra_value in data.items ()
+				if extra_key not in self.record_field_names
+			])
+
+		else:
+
+			self._extra = None
+
+		self._defaulted = frozenset (defaulted) if defaulted else None
+
+	@classmethod
+	def from_dict (cls, data):
+
+		return cls (data)
+
+	def to_dict (self):
+
+		data = collections.OrderedDict ()
+
+		defaulted = self._defaulted or ()
+
+		for field_name, attribute, default, required, sub_class \
+		in self.record_fields:
+
+			value = getattr (self, attribute)
+
+			if field_name in defaulted and value == default:
+				continue
+
+			if sub_class is not None:
+				value = sub_record_to_dict (value)
+
+			data [field_name] = value
+
+		if self._extra:
+			data.update (self._extra)
+
+		return data
+
+	def __eq__ (self, other):
+
+		return type (self) is type (other) \
+			and self.to_dict () == other.to_dict ()
+
+	def __ne__ (self, other):
+
+		return not self == other
+
+	def __repr__ (self):
+
+		return "%s (%r)" % (
+			type (self).__name__,
+			dict (self.to_dict ()))
+
+def convert_sub_record (sub_class, value):
+
+	if isinstance (value, collections.Mapping):
+		return sub_class (value)
+
+	if isinstance (value, list):
+
+		return [
+			sub_class (item)
+				if isinstance (item, collections.Mapping)
+				else item
+			for item in value
+		]
+
+	return value
+
+def sub_record_to_dict (value):
+
+	if isinstance (value, SchemaRecord):
+		return value.to_dict ()
+
+	if isinstance (value, list):
+
+		return [
+			item.to_dict ()
+				if isinstance (item, SchemaRecord)
+				else item
+			for item in value
+		]
+
+	return value
+
+def attribute_name (field_name):
+
+	name = re.sub (r"[^a-zA-Z0-9_]", "_", field_name)
+
+	if not name or name [0].isdigit () or keyword.iskeyword (name):
+		name = "_" + name
+
+	while hasattr (SchemaRecord, name):
+		name = name + "_"
+
+	return str (name)
+
+def schema_fields (schema):
+
+	return schema.fields
+
+def create_record_class (name, schema):
+
+	attributes = []
+
+	for field in schema_fields (schema):
+
+		attribute = attribute_name (field.name)
+
+		while attribute in attributes:
+			attribute = attribute + "_"
+
+		attributes.append (attribute)
+
+	return type (
+		str (attribute_name (name)),
+		(SchemaRecord,),
+		{ "__slots__": attributes })
+
+def resolve_record_fields (database, record_class, schema):
+
+	record_fields = []
+
+	for field, attribute in zip (
+			schema_fields (schema),
+			record_class.__slots__):
+
+		if field.sub_schema is None:
+			sub_class = None
+
+		elif isinstance (field.sub_schema, SchemaReference):
+			sub_class = database.record_class (field.sub_schema.name)
+
+		elif isinstance (field.sub_schema, Schema):
+			sub_class = record_class_for (field.sub_schema, field.name, database)
+
+		else:
+			sub_class = database.record_class (field.sub_schema)
+
+		record_fields.append ((
+			field.name,
+			attribute,
+			field.default,
+			field.required,
+			sub_class,
+		))
+
+	record_class.record_fields = tuple (record_fields)
+
+	record_class.record_field_names = frozenset ([
+		field.name
+		for field in schema_fields (schema)
+	])
+
+def record_class_for (schema, name = "Record", database = None):
+
+	# sub schemas given by name need a database to look them up in
+
+	record_class = create_record_class (name, schema)
+
+	resolve_record_fields (database, record_class, schema)
+
+	return record_class
+
+def records_from_dicts (record_class, items):
+
+	return [
+		record_class (item)
+		for item in items
+	]
+
+def records_to_dicts (records):
+
+	return [
+		record.to_dict ()
+		for record in records
+	]
 
 # ex: noet ts=4 filetype=yaml
@@ -0,0 +1,460 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import mmap
+import os
+import struct
+import tempfile
+
+from wbs.data import frozen_proxy_types
+
+__all__ = [
+	"save_snapshot",
+	"load_snapshot",
+	"publish_shared",
+	"open_shared",
+	"unpublish_shared",
+	"SnapshotDict",
+	"SnapshotList",
+]
+
+# snapshot layout: a header holding the magic and the root node's offset,
+# followed by nodes. every node starts with a one byte tag. containers only
+# hold the offsets of their children, which are always written first, so
+# any node can be decoded on its own straight from the mapped file.
+
+SNAPSHOT_MAGIC = b"WBSSNAP1"
+
+header_struct = struct.Struct (b"<8sQ")
+count_struct = struct.Struct (b"<I")
+int_struct = struct.Struct (b"<q")
+float_struct = struct.Struct (b"<d")
+offset_struct = struct.Struct (b"<Q")
+pair_struct = struct.Struct (b"<QQ")
+
+TAG_NONE = b"z"
+TAG_TRUE = b"t"
+TAG_FALSE = b"f"
+TAG_INT = b"i"
+TAG_BIG_INT = b"n"
+TAG_FLOAT = b"r"
+TAG_STR = b"s"
+TAG_UNICODE = b"u"
+TAG_LIST = b"L"
+TAG_DICT = b"D"
+
+INT_MIN = - 2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+class SnapshotWriter (object):
+
+	def __init__ (self, file_handle):
+
+		self.file_handle = file_handle
+		self.offset = header_struct.size
+
+		self.scalars = {}
+
+	def write (self, data):
+
+		offset = self.offset
+
+		self.file_handle.write (data)
+		self.offset += len (data)
+
+		return offset
+
+	def write_value (self, value):
+
+		# frozen proxies are written as the values they wrap
+
+		if type (value) in frozen_proxy_types:
+			value = object.__getattribute__ (value, "_value")
+
+		if isinstance (value, collections.Mapping):
+			return self.write_dict (value)
+
+		if isinstance (value, (list, tuple)) \
+		or (
+			isinstance (value, collections.Sequence)
+			and not isinstance (value, (str, unicode))
+		):
+			return self.write_list (value)
+
+		# identical scalars are only stored once
+
+		scalar_key = (value.__class__, value)
+
+		if scalar_key in self.scalars:
+			return self.scalars [scalar_key]
+
+		offset = self.write (
+			encode_scalar (value))
+
+		self.scalars [scalar_key] = offset
+
+		return offset
+
+	def write_list (self, value):
+
+		item_offsets = [
+			self.write_value (item)
+			for item in value
+		]
+
+		return self.write (b"".join ([
+			TAG_LIST,
+			count_struct.pack (len (item_offsets)),
+		] + [
+			offset_struct.pack (item_offset)
+			for item_offset in item_offsets
+		]))
+
+	def write_dict (self, value):
+
+		pair_offsets = [
+			(self.write_value (key), self.write_value (item))
+			for key, item in value.items ()
+		]
+
+		return self.write (b"".join ([
+			TAG_DICT,
+			count_struct.pack (len (pair_offsets)),
+		] + [
+			pair_struct.pack (key_offset, item_offset)
+			for key_offset, item_offset in pair_offsets
+		]))
+
+def encode_scalar (value):
+
+	if value is None:
+		return TAG_NONE
+
+	if value is True:
+		return TAG_TRUE
+
+	if value is False:
+		return TAG_FALSE
+
+	if isinstance (value, unicode):
+
+		data = value.encode ("utf-8")
+
+		return TAG_UNICODE + count_struct.pack (len (data)) + data
+
+	if isinstance (value, str):
+
+		return TAG_STR + count_struct.pack (len (value)) + value
+
+	if isinstance (value, (int, long)):
+
+		if INT_MIN <= value <= INT_MAX:
+			return TAG_INT + int_struct.pack (value)
+
+		data = str (value).encode ("ascii")
+
+		return TAG_BIG_INT + count_struct.pack (len (data)) + data
+
+	if isinstance (value, float):
+
+		return TAG_FLOAT + float_struct.pack (value)
+
+	raise Exception (
+		"Can't snapshot %s" % type (value))
+
+def save_snapshot (path, data):
+
+	temp_path = "%s.%s.tmp" % (path, os.getpid ())
+
+	with open (temp_path, "wb") \
+	as file_handle:
+
+		file_handle.write (
+			b"\0" * header_struct.size)
+
+		writer = SnapshotWriter (file_handle)
+
+		root_offset = writer.write_value (data)
+
+		file_handle.seek (0)
+
+		file_handle.write (
+			header_struct.pack (
+				SNAPSHOT_MAGIC,
+				root_offset))
+
+	os.rename (temp_path, path)
+
+class Snapshot (object):
+
+	def __init__ (self, buffer):
+
+		self.buffer = buffer
+
+		magic, self.root_offset = (
+			header_struct.unpack_from (buffer, 0))
+
+		if magic != SNAPSHOT_MAGIC:
+
+			raise Exception (
+				"Not a snapshot file")
+
+	def decode (self, offset, lazy):
+
+		buffer = self.buffer
+		tag = buffer [offset]
+
+		if tag == TAG_DICT:
+
+			if lazy:
+				return SnapshotDict (self, offset)
+
+			count, = count_struct.unpack_from (buffer, offset + 1)
+
+			return collections.OrderedDict ([
+				(
+					self.decode (key_offset, False),
+					self.decode (value_offset, False),
+				)
+				for key_offset, value_offset in self.pairs (offset, count)
+			])
+
+		if tag == TAG_LIST:
+
+			if lazy:
+				return SnapshotList (self, offset)
+
+			count, = count_struct.unpack_from (buffer, offset + 1)
+
+			return [
+				self.decode (item_offset, False)
+				for item_offset in self.offsets (offset, count)
+			]
+
+		return self.decode_scalar (tag, offset)
+
+	def decode_scalar (self, tag, offset):
+
+		buffer = self.buffer
+
+		if tag == TAG_UNICODE or tag == TAG_STR or tag == TAG_BIG_INT:
+
+			length, = count_struct.unpack_from (buffer, offset + 1)
+			start = offset + 1 + count_struct.size
+
+			data = buffer [start : start + length]
+
+			if tag == TAG_UNICODE:
+				return data.decode ("utf-8")
+
+			if tag == TAG_BIG_INT:
+				return long (data)
+
+			return data
+
+		if tag == TAG_INT:
+			return int_struct.unpack_from (buffer, offset + 1) [0]
+
+		if tag == TAG_FLOAT:
+			return float_struct.unpack_from (buffer, offset + 1) [0]
+
+		if tag == TAG_NONE:
+			return None
+
+		if tag == TAG_TRUE:
+			return True
+
+		if tag == TAG_FALSE:
+			return False
+
+		raise Exception (
+			"Invalid snapshot tag at %s" % offset)
+
+	def offsets (self, offset, count):
+
+		start = offset + 1 + count_struct.size
+
+		return struct.unpack_from (
+			b"<%sQ" % count,
+			self.buffer,
+			start)
+
+	def pairs (self, offset, count):
+
+		offsets = self.offsets (offset, count * 2)
+
+		return zip (offsets [0 : : 2], offsets [1 : : 2])
+
+	def close (self):
+
+		if isinstance (self.buffer, mmap.mmap):
+			self.buffer.close ()
+
+class SnapshotDict (collections.Mapping):
+
+	def __init__ (self, snapshot, offset):
+
+		self.snapshot = snapshot
+		self.offset = offset
+
+		self.count, = count_struct.unpack_from (
+			snapshot.buffer,
+			offset + 1)
+
+		self.index = None
+		self.decoded = {}
+
+	def load_index (self):
+
+		if self.index is not None:
+			return self.index
+
+		self.index = collections.OrderedDict ([
+			(self.snapshot.decode (key_offset, False), value_offset)
+			for key_offset, value_offset in self.snapshot.pairs (
+				self.offset,
+				self.count)
+		])
+
+		return self.index
+
+	def __getitem__ (self, key):
+
+		if key in self.decoded:
+			return self.decoded [key]
+
+		value_offset = self.load_index () [key]
+
+		value = self.decoded [key] = (
+			self.snapshot.decode (value_offset, True))
+
+		return value
+
+	def __contains__ (self, key):
+
+		return key in self.load_index ()
+
+	def __iter__ (self):
+
+		return iter (self.load_index ())
+
+	def __len__ (self):
+
+		return self.count
+
+	def thaw (self):
+
+		return self.snapshot.decode (self.offset, False)
+
+class SnapshotList (collections.Sequence):
+
+	def __init__ (self, snapshot, offset):
+
+		self.snapshot = snapshot
+		self.offset = offset
+
+		self.count, = count_struct.unpack_from (
+			snapshot.buffer,
+			offset + 1)
+
+		self.item_offsets = None
+
+	def __getitem__ (self, index):
+
+		if isinstance (index, slice):
+
+			return [
+				self [item_index]
+				for item_index in xrange (* index.indices (self.count))
+			]
+
+		if self.item_offsets is None:
+
+			self.item_offsets = self.snapshot.offsets (
+				self.offset,
+				self.count)
+
+		return self.snapshot.decode (
+			self.item_offsets [index],
+			True)
+
+	def __len__ (self):
+
+		return self.count
+
+	def __eq__ (self, other):
+
+		if not isinstance (other, (list, collections.Sequence)):
+			return NotImplemented
+
+		return len (self) == len (other) and all (
+			mine == theirs
+			for mine, theirs in zip (self, other))
+
+	def __ne__ (self, other):
+
+		return not self == other
+
+	def thaw (self):
+
+		return self.snapshot.decode (self.offset, False)
+
+def load_snapshot (path, lazy = True):
+
+	with open (path, "rb") \
+	as file_handle:
+
+		buffer = mmap.mmap (
+			file_handle.fileno (),
+			0,
+			access = mmap.ACCESS_READ)
+
+	snapshot = Snapshot (buffer)
+
+	if lazy:
+		return snapshot.decode (snapshot.root_offset, True)
+
+	try:
+		return snapshot.decode (snapshot.root_offset, False)
+
+	finally:
+		snapshot.close ()
+
+# publishing shares one copy of a tree between processes. the snapshot is
+# written once, to /dev/shm where it exists, and every process that opens it
+# maps the same pages read only, decoding only what it reads
+
+def publish_shared (data, path = None):
+
+	if path is None:
+
+		if os.path.isdir ("/dev/shm"):
+			directory = "/dev/shm"
+
+		else:
+			directory = tempfile.gettempdir ()
+
+		file_handle, path = tempfile.mkstemp (
+			prefix = "wbs-shared-",
+			dir = directory)
+
+		os.close (file_handle)
+
+	save_snapshot (path, data)
+
+	return path
+
+def open_shared (path):
+
+	return load_snapshot (path, lazy = True)
+
+def unpublish_shared (path):
+
+	# processes which already have the snapshot open keep their mapping
+
+	os.remove (path)
+
+# ex: noet ts=4 filetype=python
@@ -0,0 +1,479 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import errno
+import os
+import select
+import stat
+import struct
+import threading
+import time
+
+import yaml
+
+import wbs.yamlx as yamlx
+
+try:
+
+	import ctypes
+	import ctypes.util
+
+	libc = ctypes.CDLL (
+		ctypes.util.find_library ("c"),
+		use_errno = True)
+
+	libc.inotify_init1
+	libc.inotify_add_watch
+
+except (ImportError, OSError, AttributeError):
+
+	libc = None
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+	IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+	| IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+FILE_CHANGE_MASK = (
+	IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+
+event_struct = struct.Struct (b"iIII")
+
+class Inotify (object):
+
+	def __init__ (self):
+
+		self.fd = libc.inotify_init1 (IN_NONBLOCK | IN_CLOEXEC)
+
+		if self.fd < 0:
+			raise_errno ()
+
+	def add_watch (self, path):
+
+		wd = libc.inotify_add_watch (
+			self.fd,
+			path.encode ("utf-8"),
+			WATCH_MASK)
+
+		if wd < 0:
+			raise_errno ()
+
+		return wd
+
+	def read_events (self, timeout):
+
+		readable, _, _ = select.select ([ self.fd ], [], [], timeout)
+
+		if not readable:
+			return []
+
+		events = []
+
+		while True:
+
+			try:
+				data = os.read (self.fd, 65536)
+
+			except OSError as error:
+
+				if error.errno == errno.EAGAIN:
+					break
+
+				raise
+
+			position = 0
+
+			while position < len (data):
+
+				wd, mask, cookie, name_length = (
+					event_struct.unpack_from (data, position))
+
+				position += event_struct.size
+
+				name = (
+					data [position : position + name_length]
+						.rstrip (b"\0")
+						.decode ("utf-8"))
+
+				position += name_length
+
+				events.append ((wd, mask, name))
+
+		return events
+
+	def close (self):
+
+		os.close (self.fd)
+
+def raise_errno ():
+
+	error_number = ctypes.get_errno ()
+
+	raise OSError (
+		error_number,
+		os.strerror (error_number))
+
+# watches a directory tree loaded with yamlx.load_data and patches the tree in
+# place as files change. changes are found with inotify where it's available,
+# and by comparing stat results for the whole tree otherwise. subscribers are
+# called with a list of (action, names) tuples, where action is "created",
+# "modified" or "deleted" and names is the tuple of keys leading to the value.
+# changes are made to the tree while holding lock, so threads reading the tree
+# while the watcher runs in the background should hold it too, for example:
+#
+#     with watcher.lock:
+#         names = list (watcher.tree ["hosts"])
+
+class DataWatcher (object):
+
+	def __init__ (
+			self,
+			path,
+			tree = None,
+			poll_interval = 1.0,
+			use_inotify = True):
+
+		self.path = path
+		self.poll_interval = poll_interval
+
+		self.subscribers = []
+
+		self.watches = {}
+		self.thread = None
+		self.lock = threading.RLock ()
+		self.stopping = threading.Event ()
+
+		if use_inotify and libc:
+			self.inotify = Inotify ()
+		else:
+			self.inotify = None
+
+		self.entries = self.scan (())
+
+		if tree is None:
+			tree = yamlx.load_data (path)
+
+		self.tree = tree
+
+	def subscribe (self, callback):
+
+		self.subscribers.append (callback)
+
+	def unsubscribe (self, callback):
+
+		self.subscribers.remove (callback)
+
+	def full_path (self, names):
+
+		return "/".join ((self.path,) + names)
+
+	def scan (self, names):
+
+		# returns stat details of every entry below the named directory, and
+		# watches any directories found along the way
+
+		entries = {}
+
+		if self.inotify:
+
+			self.watches [self.inotify.add_watch (
+				self.full_path (names))] = names
+
+		for child_name in os.listdir (self.full_path (names)):
+
+			child_names = names + (child_name,)
+
+			entry = stat_entry (self.full_path (child_names))
+
+			if entry is None:
+				continue
+
+			entries [child_names] = entry
+
+			if entry [0]:
+				entries.update (self.scan (child_names))
+
+		return entries
+
+	def scan_children (self, names):
+
+		entries = {}
+
+		try:
+			child_list = os.listdir (self.full_path (names))
+
+		except OSError:
+			return entries
+
+		for child_name in child_list:
+
+			child_names = names + (child_name,)
+
+			entry = stat_entry (self.full_path (child_names))
+
+			if entry is not None:
+				entries [child_names] = entry
+
+		return entries
+
+	def check (self, timeout = 0):
+
+		if self.inotify:
+			changes = self.check_inotify (timeout)
+
+		else:
+
+			if timeout:
+				time.sleep (timeout)
+
+			changes = self.apply (
+				dict (self.entries),
+				self.scan (()),
+				set ())
+
+		if changes:
+
+			for subscriber in list (self.subscribers):
+				subscriber (changes)
+
+		return changes
+
+	def check_inotify (self, timeout):
+
+		events = self.inotify.read_events (timeout)
+
+		if not events:
+			return []
+
+		directories = set ()
+		touched = set ()
+
+		for wd, mask, name in events:
+
+			if mask & IN_Q_OVERFLOW:
+
+				return self.apply (
+					dict (self.entries),
+					self.scan (()),
+					set ())
+
+			if mask & IN_IGNORED:
+
+				self.watches.pop (wd, None)
+
+				continue
+
+			if wd not in self.watches or not name:
+				continue
+
+			names = self.watches [wd]
+
+			directories.add (names)
+
+			if not mask & IN_ISDIR \
+			and mask & FILE_CHANGE_MASK:
+
+				touched.add (names + (name,))
+
+		changes = []
+
+		for names in sorted (directories, key = len):
+
+			if names and names not in self.entries:
+				continue
+
+			old_entries = dict ([
+				(entry_names, entry)
+				for entry_names, entry in self.entries.items ()
+				if entry_names [: -1] == names
+			])
+
+			new_entries = self.scan_children (names)
+
+			for entry_names, entry in new_entries.items ():
+
+				if entry [0] and entry_names not in self.entries:
+					new_entries.update (self.scan (entry_names))
+
+			changes.extend (
+				self.apply (
+					old_entries,
+					new_entries,
+					touched))
+
+		return changes
+
+	def apply (self, old_entries, new_entries, touched):
+
+		with self.lock:
+
+			return self.apply_locked (
+				old_entries,
+				new_entries,
+				touched)
+
+	def apply_locked (self, old_entries, new_entries, touched):
+
+		changes = []
+
+		# deletions, skipping anything inside a deleted directory
+
+		deleted = set ()
+
+		for names in sorted (old_entries, key = len):
+
+			new_entry = new_entries.get (names)
+
+			if new_entry is not None \
+			and new_entry [0] == old_entries [names] [0]:
+				continue
+
+			if any (
+				names [: length] in deleted
+				for length in xrange (1, len (names))
+			):
+				continue
+
+			for entry_names in list (self.entries):
+
+				if entry_names [: len (names)] == names:
+					del self.entries [entry_names]
+
+			self.remove_value (names)
+
+			deleted.add (names)
+
+			changes.append (("deleted", names))
+
+		# creations and modifications, parents first
+
+		for names in sorted (new_entries, key = len):
+
+			new_entry = new_entries [names]
+			old_entry = self.entries.get (names)
+
+			if old_entry == new_entry and names not in touched:
+				continue
+
+			if new_entry [0]:
+
+				if old_entry is None:
+
+					self.set_value (names, {})
+					self.entries [names] = new_entry
+
+					changes.append (("created", names))
+
+				else:
+
+					self.entries [names] = new_entry
+
+				continue
+
+			try:
+				value = yamlx.load_file (self.full_path (names))
+
+			except (IOError, OSError, yaml.YAMLError):
+
+				# leave the entry stale so it is read again next time
+
+				continue
+
+			self.set_value (names, value)
+			self.entries [names] = new_entry
+
+			changes.append ((
+				"modified" if old_entry is not None else "created",
+				names))
+
+		return changes
+
+	def set_value (self, names, value):
+
+		parent = self.tree
+
+		for name in names [: -1]:
+			parent = parent [name]
+
+		parent [names [-1]] = value
+
+	def remove_value (self, names):
+
+		parent = self.tree
+
+		for name in names [: -1]:
+
+			if name not in parent:
+				return
+
+			parent = parent [name]
+
+		parent.pop (names [-1], None)
+
+	def run (self):
+
+		while not self.stopping.is_set ():
+			self.check (self.poll_interval)
+
+	def start (self):
+
+		self.stopping.clear ()
+
+		self.thread = threading.Thread (
+			target = self.run)
+
+		self.thread.daemon = True
+		self.thread.start ()
+
+	def stop (self):
+
+		self.stopping.set ()
+
+		if self.thread:
+
+			self.thread.join ()
+			self.thread = None
+
+	def close (self):
+
+		self.stop ()
+
+		if self.inotify:
+
+			self.inotify.close ()
+			self.inotify = None
+
+def stat_entry (path):
+
+	try:
+		path_stat = os.stat (path)
+
+	except OSError:
+		return None
+
+	if stat.S_ISDIR (path_stat.st_mode):
+		return (True, None, None)
+
+	return (
+		False,
+		path_stat.st_mtime,
+		path_stat.st_size)
+
+# ex: noet ts=4 filetype=python
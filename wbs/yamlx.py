@@ -4,32 +4,32 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import codecs
+import cPickle
 import collections
+import multiprocessing
 import os
 import re
 import sys
+import weakref
 import yaml
 
-# ordering code modified from here:
-# https://gist.github.com/enaeseth/844388#file-yaml_ordered_dict-py
+from wbs.hash import hash_sha1
+from wbs.schema import SchemaReference
+from wbs.snapshot import load_snapshot
+from wbs.snapshot import save_snapshot
 
-class OrderedDictYAMLLoader (yaml.Loader):
+try:
 
-	def __init__ (self, * args, ** kwargs):
+	from yaml.cyaml import CParser
 
-		yaml.Loader.__init__ (self, * args, ** kwargs)
+except ImportError:
 
-		self.add_constructor (
-			"tag:yaml.org,2002:map",
-			type (self).construct_yaml_map)
+	CParser = None
 
-		self.add_constructor (
-			"tag:yaml.org,2002:omap",
-			type (self).construct_yaml_map)
+# ordering code modified from here:
+# https://gist.github.com/enaeseth/844388#file-yaml_ordered_dict-py
 
-		self.add_constructor (
-			"tag:yaml.org,2002:str",
-			type (self).construct_yaml_str)
+class OrderedDictYAMLConstructor (object):
 
 	def construct_yaml_str (self, node):
 
@@ -82,11 +82,121 @@ class OrderedDictYAMLLoader (yaml.Loader):
 
 		return mapping
 
-def parse (string):
+	@classmethod
+	def add_ordered_constructors (cls):
+
+		cls.add_constructor (
+			"tag:yaml.org,2002:map",
+			cls.construct_yaml_map)
+
+		cls.add_constructor (
+			"tag:yaml.org,2002:omap",
+			cls.construct_yaml_map)
+
+		cls.add_constructor (
+			"tag:yaml.org,2002:str",
+			cls.construct_yaml_str)
+
+class OrderedDictYAMLLoader (
+		OrderedDictYAMLConstructor,
+		yaml.Loader):
+
+	pass
+
+OrderedDictYAMLLoader.add_ordered_constructors ()
+
+# the same loader on top of libyaml, when the extension is available
+
+if CParser:
+
+	# the python composer is only used by iter_sequence, to compose one
+	# node at a time from the events the C parser produces
+
+	class OrderedDictYAMLCLoader (
+			OrderedDictYAMLConstructor,
+			CParser,
+			yaml.composer.Composer,
+			yaml.constructor.Constructor,
+			yaml.resolver.Resolver):
+
+		def __init__ (self, stream):
+
+			CParser.__init__ (self, stream)
+			yaml.composer.Composer.__init__ (self)
+			yaml.constructor.Constructor.__init__ (self)
+			yaml.resolver.Resolver.__init__ (self)
+
+	OrderedDictYAMLCLoader.add_ordered_constructors ()
+
+	default_loader = OrderedDictYAMLCLoader
+
+else:
+
+	OrderedDictYAMLCLoader = None
+
+	default_loader = OrderedDictYAMLLoader
+
+def parse (string, loader = None):
 
 	return yaml.load (
 		string,
-		OrderedDictYAMLLoader)
+		loader or default_loader)
+
+def iter_documents (stream, loader = None):
+
+	loader = (loader or default_loader) (stream)
+
+	try:
+
+		while loader.check_data ():
+			yield loader.get_data ()
+
+	finally:
+
+		loader.dispose ()
+
+def iter_sequence (stream, loader = None):
+
+	loader = (loader or default_loader) (stream)
+
+	try:
+
+		loader.get_event ()
+
+		while not loader.check_event (yaml.StreamEndEvent):
+
+			loader.get_event ()
+
+			if not loader.check_event (yaml.SequenceStartEvent):
+
+				event = loader.peek_event ()
+
+				raise yaml.constructor.ConstructorError (
+					None,
+					None,
+					"expected a sequence document, but found %s" % (
+						event.__class__.__name__),
+					event.start_mark)
+
+			loader.get_event ()
+
+			while not loader.check_event (yaml.SequenceEndEvent):
+
+				node = yaml.composer.Composer.compose_node (
+					loader,
+					None,
+					None)
+
+				yield loader.construct_document (node)
+
+			loader.get_event ()
+			loader.get_event ()
+
+			loader.anchors = {}
+
+	finally:
+
+		loader.dispose ()
 
 def encode_simple (schema, data):
 
@@ -94,167 +204,721 @@ def encode_simple (schema, data):
 
 def encode (schema, data):
 
-	yaml = "---\n\n"
+	chunks = []
+
+	dump_document (schema, data, chunks.append)
+
+	return "".join (chunks)
+
+def dump (schema, data, stream):
+
+	dump_document (schema, data, stream.write)
+
+def dump_document (schema, data, write):
 
-	yaml += "%s" % encode_real (schema, data, "", True)
+	write ("---\n\n")
 
-	yaml += "\n\n# ex: et ts=2 filetype=yaml"
+	dump_real (schema, data, "", True, write)
 
-	return yaml
+	write ("\n\n# ex: et ts=2 filetype=yaml")
 
 def encode_real (schema, data, indent, here):
 
+	return encode_with (dump_real, schema, data, indent, here)
+
+def encode_str (schema, data, indent, here):
+
+	return encode_with (dump_str, schema, data, indent, here)
+
+def encode_list (schema, data, indent, here):
+
+	return encode_with (dump_list, schema, data, indent, here)
+
+def encode_dict (schema, data, indent, here):
+
+	return encode_with (dump_dict, schema, data, indent, here)
+
+def encode_with (dump_function, schema, data, indent, here):
+
+	chunks = []
+
+	dump_function (schema, data, indent, here, chunks.append)
+
+	return "".join (chunks)
+
+def dump_real (schema, data, indent, here, write):
+
 	if isinstance (data, unicode):
-		return encode_str (schema, data, indent, here)
+		return dump_str (schema, data, indent, here, write)
 
 	if isinstance (data, str):
-		return encode_str (schema, unicode (data, "utf8"), indent, here)
+		return dump_str (schema, unicode (data, "utf8"), indent, here, write)
 
 	if isinstance (data, int):
-		return encode_str (schema, unicode (data), indent, here)
+		return dump_str (schema, unicode (data), indent, here, write)
 
 	if isinstance (data, dict):
-		return encode_dict (schema, data, indent, here)
+		return dump_dict (schema, data, indent, here, write)
 
-	if isinstance (data, list):
-		return encode_list (schema, data, indent, here)
+	if isinstance (data, (list, tuple)):
+		return dump_list (schema, data, indent, here, write)
 
 	raise Exception ("Don't know how to handle %s" % type (data))
 
-def encode_str (schema, data, indent, here):
+def dump_str (schema, data, indent, here, write):
 
-	return "\"%s\"" % (
+	write ("\"%s\"" % (
 		data.replace (
 			"\"",
-			"\\\""))
+			"\\\"")))
 
-def encode_list (schema, data, indent, here):
+def dump_list (schema, data, indent, here, write):
 
 	if not data:
-		return "[]"
+		write ("[]")
+		return
 
-	yaml = ""
 	next_indent = indent + "  "
 
 	for item in data:
 
 		if not here:
 
-			yaml += "\n"
-			yaml += indent
+			write ("\n")
+			write (indent)
 
-		yaml += "- "
-		yaml += encode_real (schema, item, next_indent, True)
+		write ("- ")
+		dump_real (schema, item, next_indent, True, write)
 
 		here = False
 
-	return yaml
-
-def encode_dict (schema, data, indent, here):
+def dump_dict (schema, data, indent, here, write):
 
 	if not data:
-		return "{}"
+		write ("{}")
+		return
+
+	if schema:
+
+		compile_encoder (schema) (
+			data,
+			indent,
+			here,
+			write)
+
+	else:
+
+		dump_other_keys (
+			data,
+			no_field_names,
+			indent,
+			here,
+			write)
+
+	write ("\n")
 
-	yaml = ""
+def dump_other_keys (data, field_names, indent, here, write):
+
+	new_group = True
 	next_indent = indent + "  "
 
-	done_keys = {}
+	for key in sorted (data.keys ()):
+
+		if key in field_names:
+			continue;
+
+		#sys.stderr.write ("warning: unrecognised key: %s\n" % key)
+
+		if not here:
+
+			write ("\n")
+			write (indent)
+
+			if new_group:
+
+				write ("\n")
+				write (indent)
+
+		write (encode_key (key))
+		write (": ")
+		dump_real (None, data [key], next_indent, False, write)
+
+		here = False
+		new_group = False
+
+no_field_names = frozenset ()
+
+# compiled encoders are cached per schema object, so a schema must not be
+# modified once it has been used to encode data. references are resolved
+# first, every time, so a schema defined again under the same name gets an
+# encoder of its own
+
+compiled_encoders = weakref.WeakKeyDictionary ()
+
+def compile_encoder (schema):
+
+	if isinstance (schema, SchemaReference):
+		schema = schema.resolve ()
+
+	if schema in compiled_encoders:
+		return compiled_encoders [schema]
+
+	field_groups = [
+		[
+			(
+				field.name,
+				encode_key (field.name),
+				field.default,
+				field.sub_schema,
+			)
+			for field in group.fields
+		]
+		for group in schema.groups
+	]
+
+	field_names = frozenset ([
+		field.name
+		for group in schema.groups
+		for field in group.fields
+	])
+
+	def dump_schema_dict (data, indent, here, write):
+
+		next_indent = indent + "  "
+
+		for group_fields in field_groups:
+
+			new_group = True
+
+			for name, key_text, default, sub_schema in group_fields:
+
+				if name in data:
+					value = data [name]
+				elif default is not None:
+					value = default
+				else:
+					continue
+
+				if not here:
+
+					write ("\n")
+					write (indent)
+
+					if new_group:
+
+						write ("\n")
+						write (indent)
+
+				write (key_text)
+				write (": ")
+				dump_real (sub_schema, value, next_indent, False, write)
+
+				here = False
+				new_group = False
+
+		dump_other_keys (
+			data,
+			field_names,
+			indent,
+			here,
+			write)
+
+	compiled_encoders [schema] = dump_schema_dict
+
+	return dump_schema_dict
+
+def load_data (
+		path,
+		parallel = False,
+		workers = None,
+		cache = None,
+		lazy = False):
+
+	if os.path.isfile (path):
+		return load_files ([ path ], cache = cache) [0]
+
+	if not os.path.isdir (path):
+
+		raise Exception (
+			"File or directory doesn't exist: %s" % (
+				path))
+
+	if lazy and parallel:
+
+		raise Exception (
+			"Can't load data both lazily and in parallel")
+
+	if lazy:
+		return LazyDataDirectory (path, cache)
+
+	entries = discover_data (path)
+
+	file_paths = [
+		child_path
+		for names, child_path, is_dir in entries
+		if not is_dir
+	]
+
+	file_datas = load_files (
+		file_paths,
+		parallel = parallel,
+		workers = workers,
+		cache = cache)
+
+	# reassemble the tree in discovery order
+
+	ret = {}
+
+	directories = {
+		(): ret,
+	}
+
+	file_datas = iter (file_datas)
+
+	for names, child_path, is_dir in entries:
+
+		parent = directories [names [: -1]]
+
+		if is_dir:
+
+			parent [names [-1]] = directories [names] = {}
+
+		else:
+
+			parent [names [-1]] = next (file_datas)
+
+	return ret
+
+def discover_data (path, names = ()):
+
+	entries = []
+
+	for child_name in os.listdir (path):
+
+		child_path = path + "/" + child_name
+		child_names = names + (child_name,)
+
+		if os.path.isdir (child_path):
+
+			entries.append (
+				(child_names, child_path, True))
+
+			entries.extend (
+				discover_data (
+					child_path,
+					child_names))
+
+		elif os.path.isfile (child_path):
+
+			entries.append (
+				(child_names, child_path, False))
+
+		else:
+
+			raise Exception (
+				"File or directory doesn't exist: %s" % (
+					child_path))
+
+	return entries
+
+def load_files (file_paths, parallel = False, workers = None, cache = None):
+
+	if cache:
+
+		file_datas = [
+			cache.get (file_path)
+			for file_path in file_paths
+		]
+
+		missing_paths = [
+			file_path
+			for file_path, file_data in zip (file_paths, file_datas)
+			if file_data is cache_miss
+		]
 
-	if schema:
-		field_groups = schema.groups
 	else:
-		field_groups = []
 
-	for group in field_groups:
+		missing_paths = file_paths
 
-		new_group = True
+	if parallel and len (missing_paths) > 1:
 
-		for field in group.fields:
+		missing_datas = load_files_parallel (
+			missing_paths,
+			workers)
 
-			if field.name in data:
-				value = data [field.name]
-			elif field.default is not None:
-				value = field.default
-			else:
-				continue
+	else:
 
-			if not here:
+		missing_datas = map (load_file, missing_paths)
 
-				yaml += "\n"
-				yaml += indent
+	if not cache:
+		return missing_datas
 
-				if new_group:
+	missing_datas = iter (missing_datas)
 
-					yaml += "\n"
-					yaml += indent
+	for index, file_path in enumerate (file_paths):
 
-			yaml += encode_key (field.name)
-			yaml += ": "
-			yaml += encode_real (field.sub_schema, value, next_indent, False)
+		if file_datas [index] is not cache_miss:
+			continue
 
-			done_keys [field.name] = True
+		file_data = next (missing_datas)
 
-			here = False
-			new_group = False
+		cache.put (file_path, file_data)
 
-	new_group = True
+		file_datas [index] = file_data
 
-	for key in sorted (data.keys ()):
+	return file_datas
 
-		if key in done_keys:
-			continue;
+def load_file (path):
 
-		#sys.stderr.write ("warning: unrecognised key: %s\n" % key)
+	with codecs.open (
+		filename = path,
+		encoding = "utf-8") \
+	as file_handle:
 
-		value = data [key]
+		return parse (
+			file_handle)
 
-		if not here:
+def load_files_parallel (file_paths, workers = None):
 
-			yaml += "\n"
-			yaml += indent
+	if not workers:
+		workers = multiprocessing.cpu_count ()
 
-			if new_group:
+	chunk_size = (
+		len (file_paths) // (workers * 4) + 1)
 
-				yaml += "\n"
-				yaml += indent
+	pool = multiprocessing.Pool (workers)
 
-		yaml += encode_key (key)
-		yaml += ": "
-		yaml += encode_real (None, data [key], next_indent, False)
+	try:
 
-		here = False
-		new_group = False
+		return pool.map (
+			load_file,
+			file_paths,
+			chunk_size)
+
+	finally:
+
+		pool.close ()
+		pool.join ()
+
+# save_data treats plain dicts (as built by load_data) and lazy directories
+# as directories, and writes everything else as one yaml file. schemas maps
+# relative paths to the schema used for that file, or for every file under
+# that directory
+
+SaveDataResult = collections.namedtuple (
+	"SaveDataResult",
+	[ "written", "skipped" ])
+
+def save_data (
+		path,
+		tree,
+		schemas = None,
+		parallel = False,
+		workers = None):
+
+	file_entries = list (
+		discover_tree (tree))
+
+	encode_jobs = [
+		(find_schema (schemas, names), data)
+		for names, data in file_entries
+	]
+
+	if parallel and len (encode_jobs) > 1:
+
+		if not workers:
+			workers = multiprocessing.cpu_count ()
+
+		chunk_size = (
+			len (encode_jobs) // (workers * 4) + 1)
+
+		pool = multiprocessing.Pool (workers)
+
+		try:
+
+			file_contents = pool.map (
+				encode_file,
+				encode_jobs,
+				chunk_size)
+
+		finally:
+
+			pool.close ()
+			pool.join ()
+
+	else:
+
+		file_contents = map (encode_file, encode_jobs)
+
+	num_written = 0
+	num_skipped = 0
+
+	for (names, data), contents in zip (file_entries, file_contents):
+
+		file_path = "/".join ((path,) + names)
+
+		if write_if_changed (file_path, contents):
+			num_written += 1
+
+		else:
+			num_skipped += 1
+
+	return SaveDataResult (
+		written = num_written,
+		skipped = num_skipped)
+
+def discover_tree (tree, names = ()):
+
+	for child_name, child_data in tree.items ():
+
+		child_names = names + (child_name,)
+
+		if is_data_directory (child_data):
+
+			for entry in discover_tree (child_data, child_names):
+				yield entry
+
+		else:
+
+			yield child_names, child_data
+
+def is_data_directory (data):
+
+	return (
+		type (data) is dict
+		or isinstance (data, LazyDataDirectory))
+
+def find_schema (schemas, names):
+
+	if not schemas:
+		return None
+
+	for length in xrange (len (names), 0, -1):
+
+		prefix = "/".join (names [: length])
+
+		if prefix in schemas:
+			return schemas [prefix]
+
+	return None
+
+def encode_file (job):
+
+	schema, data = job
+
+	return encode (schema, data).encode ("utf-8")
+
+def write_if_changed (file_path, contents):
+
+	if os.path.isfile (file_path) \
+	and os.path.getsize (file_path) == len (contents):
+
+		with open (file_path, "rb") \
+		as file_handle:
 
-	return yaml + "\n"
+			if file_handle.read () == contents:
+				return False
 
-def load_data (path):
+	directory_path = os.path.dirname (file_path)
 
-	if os.path.isdir (path):
+	if directory_path and not os.path.isdir (directory_path):
+		os.makedirs (directory_path)
 
-		ret = {}
+	temp_path = "%s.%s.tmp" % (file_path, os.getpid ())
+
+	with open (temp_path, "wb") \
+	as file_handle:
+
+		file_handle.write (contents)
+
+	os.rename (temp_path, file_path)
+
+	return True
+
+# directory mapping returned by load_data (path, lazy = True). children are
+# listed up front but files are only parsed when first accessed
+
+class LazyDataDirectory (collections.Mapping):
+
+	def __init__ (self, path, cache = None):
+
+		self.path = path
+		self.cache = cache
+
+		self.children = collections.OrderedDict ()
+		self.loaded = {}
 
 		for child_name in os.listdir (path):
 
 			child_path = path + "/" + child_name
-			ret [child_name] = load_data (child_path)
 
-		return ret
+			if os.path.isdir (child_path):
+
+				self.children [child_name] = (child_path, True)
+
+			elif os.path.isfile (child_path):
+
+				self.children [child_name] = (child_path, False)
+
+			else:
+
+				raise Exception (
+					"File or directory doesn't exist: %s" % (
+						child_path))
+
+	def __getitem__ (self, key):
+
+		if key in self.loaded:
+			return self.loaded [key]
+
+		child_path, is_dir = self.children [key]
+
+		if is_dir:
+
+			value = LazyDataDirectory (
+				child_path,
+				self.cache)
+
+		else:
+
+			value = load_files (
+				[ child_path ],
+				cache = self.cache) [0]
+
+		self.loaded [key] = value
+
+		return value
+
+	def __contains__ (self, key):
+
+		return key in self.children
+
+	def __iter__ (self):
+
+		return iter (self.children)
+
+	def __len__ (self):
+
+		return len (self.children)
+
+	def __repr__ (self):
+
+		return "LazyDataDirectory (%r)" % self.path
+
+cache_miss = object ()
+
+# persistent parse cache for load_data, one pickle per file. entries are
+# reused while mtime and size match, or while the contents hash the same
+
+class DataCache (object):
+
+	def __init__ (self, path):
+
+		self.path = path
 
-	elif os.path.isfile (path):
+		self.hits = 0
+		self.misses = 0
 
-		with codecs.open (
-			filename = path,
-			encoding = "utf-8") \
+		self.pending = {}
+
+		if not os.path.isdir (path):
+			os.makedirs (path)
+
+	def entry_path (self, file_path):
+
+		return "%s/%s" % (
+			self.path,
+			hash_sha1 (
+				os.path.abspath (file_path).encode ("utf-8")))
+
+	def read_entry (self, file_path):
+
+		try:
+
+			with open (self.entry_path (file_path), "rb") \
+			as file_handle:
+
+				return cPickle.load (file_handle)
+
+		except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+
+			return None
+
+	def write_entry (self, file_path, entry):
+
+		entry_path = self.entry_path (file_path)
+		temp_path = "%s.%s.tmp" % (entry_path, os.getpid ())
+
+		with open (temp_path, "wb") \
 		as file_handle:
 
-			return parse (
-				file_handle)
+			cPickle.dump (
+				entry,
+				file_handle,
+				cPickle.HIGHEST_PROTOCOL)
 
-	else:
+		os.rename (temp_path, entry_path)
 
-		raise Exception (
-			"File or directory doesn't exist: %s" % (
-				path))
+	def get (self, file_path):
+
+		file_stat = os.stat (file_path)
+
+		entry = self.read_entry (file_path)
+
+		if entry \
+		and entry ["path"] == file_path \
+		and entry ["mtime"] == file_stat.st_mtime \
+		and entry ["size"] == file_stat.st_size:
+
+			self.hits += 1
+
+			return entry ["data"]
+
+		with open (file_path, "rb") \
+		as file_handle:
+
+			content_hash = hash_sha1 (
+				file_handle.read ())
+
+		if entry \
+		and entry ["path"] == file_path \
+		and entry ["hash"] == content_hash:
+
+			entry ["mtime"] = file_stat.st_mtime
+			entry ["size"] = file_stat.st_size
+
+			self.write_entry (file_path, entry)
+
+			self.hits += 1
+
+			return entry ["data"]
+
+		self.misses += 1
+
+		self.pending [file_path] = (
+			file_stat.st_mtime,
+			file_stat.st_size,
+			content_hash)
+
+		return cache_miss
+
+	def put (self, file_path, data):
+
+		mtime, size, content_hash = (
+			self.pending.pop (file_path))
+
+		self.write_entry (file_path, {
+			"path": file_path,
+			"mtime": mtime,
+			"size": size,
+			"hash": content_hash,
+			"data": data,
+		})
+
+	def reset_counters (self):
+
+		self.hits = 0
+		self.misses = 0
 
 def encode_key (key):
 